@@ -1,6 +1,9 @@
 from yapsy.IPlugin import IPlugin
 import random
+import warnings
 import numpy as np
+import tcod.console
+from dataclasses import dataclass
 import Main_Menu.Create_World_State as mapclass
 from Library import UI
 from Library.UI import BG
@@ -14,6 +17,20 @@ class Settlements_Plugin(IPlugin):
         return this_mod
 
 
+# a settlement without a town map opens onto an empty square
+@dataclass
+class Empty_Town_Stub:
+    height: int
+    width: int
+
+    def open(self, **kwargs) -> mapclass.MapData:
+        screen = np.zeros((self.height, self.width), dtype=tcod.console.rgb_graphic)
+        screen[...] = (32, [76, 76, 76], list(BG))
+        submap = mapclass.MapData(self.height, self.width)
+        submap.set_default_screen(screen)
+        return submap
+
+
 class Settlements:
     def __init__(self, obj, peoples) -> None:
         self.id = obj["id"]
@@ -30,6 +47,8 @@ class Settlements:
         self.icon_color = obj["icon_color"]
         self.require_biome = obj["require_biome"]
         self.prefered_biome = obj["prefered_biome"]
+        # 1 only keeps settlements off each other's cell
+        self.min_spacing = obj.get("min_spacing", 1)
         self.noise_id = obj["noise_id"]
 
         self.maps = None
@@ -68,41 +87,28 @@ class Settlements:
         self.night_color_id = obj["night_color_id"]
         self.light = obj["light"]
 
-        self.settlement_icons = []
+        self.settlement_icons = {}
 
         return
 
     def update(self, **kwargs) -> None:
         if not self.initialized:
             self.maps = kwargs["map"]
+            self.positions = self.place_settlements(self.maps)
             for i in range(self.max_num_settlements):
-                if self.statistics[i] != 0:
-                    while True:
-                        j = random.randint(0, kwargs["map"].get_height() - 1)
-                        k = random.randint(0, kwargs["map"].get_width() - 1)
-                        if self.require_biome == 1:
-                            if (kwargs["map"].get_attribute_at(self.biomes_id, j, k) == self.prefered_biome) and (not (j, k) in list(self.positions.values())):
-                                break
-                        else:
-                            if not (j, k) in list(self.positions.values()):
-                                break
-                    self.positions[i] = [j, k]
-                    self.settlement_icons.append(UI.ntcod_entity(self.icononmap, self.icon_color, j, k, kwargs["window"].get(0)[0], self.name))
-                    if ((self.town_map_id in kwargs["mods"].keys()) and (self.simulation_id in kwargs["mods"].keys())) and kwargs["mods"][self.simulation_id].get_simulated():
-                        this_families = kwargs["mods"][self.simulation_id].get_families()
-                        submap = kwargs["mods"][self.town_map_id].generate_town_map(this_families, i, kwargs["mods"][self.noise_id])
-                        self.maps.set_submap(j, k, self.settlement_name[i], self.id, submap)
+                if i in self.positions:
+                    j, k = self.positions[i]
+                    self.settlement_icons[i] = UI.ntcod_entity(self.icononmap, self.icon_color, j, k, kwargs["window"].get(0)[0], self.name)
+                    # towns are generated only when entered, the households are looked up then
+                    if self.town_map_id in kwargs["mods"].keys():
+                        submap = kwargs["mods"][self.town_map_id].get_town_stub(i, kwargs["mods"][self.noise_id], self.simulation_id)
                     else:
-                        defaultscreen = []
-                        for defualt_i in range(self.height):
-                            defaultscreen.append([[32, [76, 76, 76], list(BG)]] * self.width)
-                        submap = mapclass.MapData(self.height, self.width)
-                        submap.set_default_screen(defaultscreen)
-                        self.maps.set_submap(j, k, self.settlement_name[i], self.id, submap)
+                        submap = Empty_Town_Stub(self.height, self.width)
+                    self.maps.set_submap(j, k, self.settlement_name[i], self.id, submap)
             self.initialized = True
         if self.night_id in kwargs["mods"].keys():
             for i in range(self.max_num_settlements):
-                if self.statistics[i] != 0:
+                if i in self.positions:
                     if kwargs["map"].get_attribute_at(self.night_color_id, self.positions[i][0], self.positions[i][1]) == 0:
                         self.settlement_icons[i].update_default_color(self.light)
                         self.settlement_icons[i].no_color_layer = True
@@ -112,6 +118,43 @@ class Settlements:
                         self.settlement_icons[i].no_color_layer = False
         return
 
+    # every settlement draws from the cells that meet the biome requirement, taken in one random order,
+    # a cell closer than min_spacing to a placed settlement is skipped for good since spacing only gets stricter,
+    # settlements left without a cell are not placed and a warning names them
+    def place_settlements(self, local_map):
+        if self.require_biome == 1:
+            candidates = np.flatnonzero(local_map.get_attribute(self.biomes_id) == self.prefered_biome)
+        else:
+            candidates = np.arange(local_map.get_height() * local_map.get_width())
+        candidates = candidates[np.random.permutation(len(candidates))]
+        cell = max(1, self.min_spacing)
+        grid = {}
+        positions = {}
+        next_candidate = 0
+        for i in range(self.max_num_settlements):
+            if self.statistics[i] == 0:
+                continue
+            close = True
+            while close and (next_candidate < len(candidates)):
+                j, k = divmod(int(candidates[next_candidate]), local_map.get_width())
+                next_candidate += 1
+                # only settlements in the neighbouring grid cells can be closer than min_spacing
+                close = False
+                for grid_y in range(j // cell - 1, j // cell + 2):
+                    for grid_x in range(k // cell - 1, k // cell + 2):
+                        for y, x in grid.get((grid_y, grid_x), []):
+                            if (y - j) ** 2 + (x - k) ** 2 < self.min_spacing ** 2:
+                                close = True
+            if close:
+                unplaced = [str(self.settlement_name[n]) for n in range(i, self.max_num_settlements) if self.statistics[n] != 0]
+                warnings.warn(self.id + ": " + ", ".join(unplaced) + " not placed, " + str(len(positions)) +
+                              " settlements used up " + str(len(candidates)) + " candidate cells with min_spacing " +
+                              str(self.min_spacing) + (", prefered_biome " + str(self.prefered_biome) if self.require_biome == 1 else ""))
+                break
+            grid.setdefault((j // cell, k // cell), []).append((j, k))
+            positions[i] = [j, k]
+        return positions
+
     def get_statistics(self):
         return self.statistics
 
@@ -131,7 +174,7 @@ class Settlements:
             posi_y = mods[self.player_id].get_position()[0]
             posi_x = mods[self.player_id].get_position()[1]
             for i in range(self.max_num_settlements):
-                if self.statistics[i] != 0:
+                if i in self.positions:
                     if [posi_y, posi_x] == self.positions[i]:
                         output = ["you are in " + self.settlement_name[i]]
                         output.extend(np.array(["population: " + str(self.statistics[i])]))
@@ -2,6 +2,7 @@ from yapsy.IPlugin import IPlugin
 import numpy as np
 import collections
 import tcod
+from scipy.sparse.csgraph import minimum_spanning_tree
 from Library import UI
 
 
@@ -18,10 +19,8 @@ class Trails:
 
         self.icon_color = obj["icon_color"]
 
-        self.costmap = []
         self.count = 0
 
-        self.distances = {}
         self.valid_paths = []
         self.added = False
         self.searched = False
@@ -32,47 +31,63 @@ class Trails:
         self.settlements_id = obj["settlements_id"]
         return
 
-    def update(self, **kwargs) -> None:
-        # initial
-        self.costmap = []
-        for y in range(kwargs["map"].get_height()):
-            self.costmap.append([1] * kwargs["map"].get_width())
-        self.costmap = np.array(self.costmap, dtype=np.float32)
+    # integer cost of every tile, 0 blocks it: climbing costs with elevation and the sea is blocked
+    def make_costmap(self, local_map):
+        costmap = np.ones((local_map.get_height(), local_map.get_width()), dtype=np.float32)
         # elevation
-        if self.elevation_id in kwargs["map"].get_layer_names():
-            elevation = np.array(kwargs["map"].get_attribute(self.elevation_id))
-            self.costmap = self.costmap - 1 + elevation
+        if self.elevation_id in local_map.get_layer_names():
+            costmap = costmap - 1 + local_map.get_attribute(self.elevation_id)
         # biome
-        if self.biome_id in kwargs["map"].get_layer_names():
-            biome = np.array(kwargs["map"].get_attribute(self.biome_id))
-            self.costmap = self.costmap * (1 - (biome == 14))
-
-        self.costmap[self.costmap < 0] = 0
+        if self.biome_id in local_map.get_layer_names():
+            costmap = costmap * (1 - (local_map.get_attribute(self.biome_id) == 14))
+        costmap[costmap < 0] = 0
+        # tenths of the cost, so a road's discount still leaves a positive cost
+        cost = np.rint(costmap * 10).astype(np.int32)
+        cost[(cost == 0) & (costmap > 0)] = 1
+        return cost
+
+    # pairs of settlements joined by a road, the minimum spanning tree of their straight distances,
+    # grouped by the settlement the roads start from
+    @staticmethod
+    def road_network(points):
+        distance = np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+        tree = minimum_spanning_tree(distance).tocoo()
+        network = collections.OrderedDict()
+        for index in np.argsort(tree.data, kind="stable"):
+            network.setdefault(int(tree.row[index]), []).append(int(tree.col[index]))
+        return network
 
+    def update(self, **kwargs) -> None:
         if not self.searched:
-            self.costmap = np.array(self.costmap, dtype=np.float32)
+            # the costs are only needed while routing, so they are not kept
+            costmap = self.make_costmap(kwargs["map"])
 
             if self.settlements_id in kwargs["mods"].keys():
                 settlements = kwargs["mods"][self.settlements_id]
-                positions = settlements.get_positions()
-                for index1 in range(len(positions)):
-                    for index2 in range(len(positions)):
-                        if index2 > index1:
-                            posi1 = positions[index1]
-                            posi2 = positions[index2]
-                            distance =  (posi1[0] - posi2[0]) ** 2 + (posi1[1] - posi2[1]) ** 2
-                            self.distances[distance] = [posi1, posi2]
-                order_dist = collections.OrderedDict(sorted(self.distances.items()))
-
-                for key, value in order_dist.items():
-                    astar = tcod.path.AStar(self.costmap, diagonal=False)
-                    start = tuple([value[0][0], value[0][1]])
-                    end = tuple([value[1][0], value[1][1]])
-                    path = astar.get_path(*start, *end)
-                    if len(path) > 0:
-                        path.insert(0, start)
+                positions = list(settlements.get_positions().values())
+                towns = set(tuple(posi) for posi in positions)
+                trails = set()
+                if len(positions) > 1:
+                    network = self.road_network(np.array(positions, dtype=np.float64))
+                else:
+                    network = {}
+
+                # one search from each settlement reaches all of its neighbours in the tree,
+                # roads found are discounted before the next search
+                for index1, targets in network.items():
+                    start = tuple(positions[index1])
+                    pathfinder = tcod.path.Pathfinder(tcod.path.SimpleGraph(cost=costmap, cardinal=1, diagonal=0))
+                    pathfinder.add_root(start)
+                    found = []
+                    for index2 in targets:
+                        end = tuple(positions[index2])
+                        pathfinder.resolve(end)
+                        if pathfinder.distance[end] == np.iinfo(pathfinder.distance.dtype).max:
+                            continue
+                        found.append([tuple(step) for step in pathfinder.path_to(end).tolist()])
+                    for path in found:
                         for i in range(len(path)):
-                            self.costmap[path[i][0]][path[i][1]] = self.costmap[path[i][0]][path[i][1]] * 0.1
+                            costmap[path[i][0]][path[i][1]] = max(1, costmap[path[i][0]][path[i][1]] // 10)
                             if (i != 0) and (i != len(path) - 1):
                                 if ((path[i-1][0] > path[i][0]) and (path[i+1][0] < path[i][0])) or ((path[i-1][0] < path[i][0]) and (path[i+1][0] > path[i][0])):
                                     trail_icon = UI.ntcod_entity("│", self.icon_color, path[i][0], path[i][1], kwargs["window"].get(0)[0], self.id, False)
@@ -86,8 +101,9 @@ class Trails:
                                     trail_icon = UI.ntcod_entity("└", self.icon_color, path[i][0], path[i][1], kwargs["window"].get(0)[0], self.id, False)
                                 elif ((path[i-1][0] < path[i][0]) and (path[i+1][1] < path[i][1])) or ((path[i-1][1] < path[i][1]) and (path[i+1][0] < path[i][0])):
                                     trail_icon = UI.ntcod_entity("┘", self.icon_color, path[i][0], path[i][1], kwargs["window"].get(0)[0], self.id, False)
-                                if ((path[i][0], path[i][1]) not in self.all_paths) and ([path[i][0], path[i][1]] not in list(settlements.get_positions().values())):
-                                    self.all_paths.append((path[i][0], path[i][1]))
+                                if (path[i] not in trails) and (path[i] not in towns):
+                                    trails.add(path[i])
+                                    self.all_paths.append(path[i])
                                     kwargs["window"].get(0)[0].add_entity(trail_icon, self.id)
                         self.valid_paths.append(path)
             self.searched = True
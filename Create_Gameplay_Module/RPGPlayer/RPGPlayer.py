@@ -77,7 +77,7 @@ class RPGPlayer:
         self.icon.update(self.posi_y, self.posi_x)
         icon_bg = self.current_tile.screen[self.posi_y][self.posi_x][2]
         if (self.last_bg is None) or (tuple(self.last_bg) != tuple(icon_bg)):
-            if sum(icon_bg) > 382.5:
+            if sum(int(c) for c in icon_bg) > 382.5:
                 new_color = [0, 0, 0]
             else:
                 new_color = [255, 255, 255]
@@ -159,7 +159,7 @@ class RPGPlayer:
             self.tiles.append(self.current_tile)
             window.add_frame(self.current_tile, change_focus=False,frameid="rpgplayer_submap" )
 
-            self.maps.append(self.maps[-1].get_submap(self.posi_y, self.posi_x)[choice][1])
+            self.maps.append(self.maps[-1].open_submap(self.posi_y, self.posi_x, choice, mods=kwargs["mods"]))
             self.height = self.maps[-1].get_height()
             self.width = self.maps[-1].get_width()
             self.maps[-1].set_default_screen_to_tile(self.current_tile)
@@ -23,6 +23,25 @@ biomedict = {
     16: "BEACH"
 }
 
+# display color of each biome, indexed by biome id
+biomecolor = numpy.full((len(biomedict) + 1, 3), BG)
+biomecolor[1] = (234, 222, 181)
+biomecolor[2] = (171, 212, 128)
+biomecolor[3] = (91, 196, 124)
+biomecolor[4] = (63, 151, 139)
+biomecolor[5] = (206, 216, 155)
+biomecolor[6] = (122, 190, 131)
+biomecolor[7] = (77, 177, 136)
+biomecolor[8] = (163, 196, 168)
+biomecolor[9] = (187, 211, 164)
+biomecolor[10] = (72, 79, 98)
+biomecolor[11] = (141, 151, 168)
+biomecolor[12] = (220, 223, 160)
+biomecolor[13] = (246, 248, 248)
+biomecolor[14] = (86, 180, 200)
+biomecolor[15] = (246, 248, 248)
+biomecolor[16] = (234, 222, 181)
+
 
 class Biomes_Plugin(IPlugin):
     def initialize(self, **kwargs):
@@ -35,84 +54,53 @@ class Biomes_Plugin(IPlugin):
 class Biomes:
     def __init__(self, obj, local_map) -> None:
         self.id = obj["id"]
-        temperature = local_map.get_attribute("temperature")
-        moisture = local_map.get_attribute("moisture")
-        elevation = local_map.get_attribute("elevation")
-
-        biomes = []
-        self.biomesout = numpy.full((len(temperature), len(temperature[0]), 3), BG)
+        self.local_map = local_map
         self.setdefault = False
-        for y in range(len(temperature)):
-            biomes.append([0] * len(temperature[0]))
-            for x in range(len(temperature[0])):
-                if temperature[y][x] >= 24:
-                    if moisture[y][x] <= 0.167:
-                        biomes[y][x] = 1
-                        self.biomesout[y][x] = (234, 222, 181)
-                    elif moisture[y][x] <= 0.333:
-                        biomes[y][x] = 2
-                        self.biomesout[y][x] = (171, 212, 128)
-                    elif moisture[y][x] <= 0.667:
-                        biomes[y][x] = 3
-                        self.biomesout[y][x] = (91, 196, 124)
-                    else:
-                        biomes[y][x] = 4
-                        self.biomesout[y][x] = (63, 151, 139)
-                elif temperature[y][x] >= 12:
-                    if moisture[y][x] <= 0.167:
-                        biomes[y][x] = 5
-                        self.biomesout[y][x] = (206, 216, 155)
-                    elif moisture[y][x] <= 0.5:
-                        biomes[y][x] = 2
-                        self.biomesout[y][x] = (171, 212, 128)
-                    elif moisture[y][x] <= 0.833:
-                        biomes[y][x] = 6
-                        self.biomesout[y][x] = (122, 190, 131)
-                    else:
-                        biomes[y][x] = 7
-                        self.biomesout[y][x] = (77, 177, 136)
-                elif temperature[y][x] >= 0:
-                    if moisture[y][x] <= 0.333:
-                        biomes[y][x] = 5
-                        self.biomesout[y][x] = (206, 216, 155)
-                    elif moisture[y][x] <= 0.667:
-                        biomes[y][x] = 8
-                        self.biomesout[y][x] = (163, 196, 168)
-                    else:
-                        biomes[y][x] = 9
-                        self.biomesout[y][x] = (187, 211, 164)
-                else:
-                    if moisture[y][x] <= 0.167:
-                        biomes[y][x] = 10
-                        self.biomesout[y][x] = (72, 79, 98)
-                    elif moisture[y][x] <= 0.333:
-                        biomes[y][x] = 11
-                        self.biomesout[y][x] = (141, 151, 168)
-                    elif moisture[y][x] <= 0.5:
-                        biomes[y][x] = 12
-                        self.biomesout[y][x] = (220, 223, 160)
-                    else:
-                        biomes[y][x] = 13
-                        self.biomesout[y][x] = (246, 248, 248)
-
-                if elevation[y][x] <= 0:
-                    biomes[y][x] = 14
-                    self.biomesout[y][x] = (86, 180, 200)
-                    if temperature[y][x] <= 0:
-                        biomes[y][x] = 15
-                        self.biomesout[y][x] = (246, 248, 248)
-                elif elevation[y][x] <= 27:
-                    biomes[y][x] = 16
-                    self.biomesout[y][x] = (234, 222, 181)
-                self.biomesout[y][x] = list(self.biomesout[y][x])
-
-        biomes = numpy.array(biomes)
-        local_map.set_attribute(self.id, biomes)
-
-        tiles = [[[ord(" "), FGN, x] for x in row] for row in self.biomesout]
-        local_map.set_default_screen(tiles)
+
+        # climate bands from hot to cold, the last one takes everything colder
+        self.min_temperature = [band["min_temperature"] for band in obj["climate"][0:-1]]
+        self.max_moisture = []
+        self.band_biomes = []
+        for band in obj["climate"]:
+            if len(band["biomes"]) != len(band["max_moisture"]) + 1:
+                raise ValueError("a climate band needs one more biome than moisture bounds")
+            self.max_moisture.append(numpy.array(band["max_moisture"]))
+            self.band_biomes.append(numpy.array(band["biomes"], dtype=numpy.uint8))
+        self.ocean = obj["ocean"]
+        self.beach = obj["beach"]
+
+        local_map.register_layer(self.id, numpy.uint8)
+        local_map.set_attribute_generator(self.id, self.generate,
+                                          local_map.make_layer_key("Biomes", obj, obj["Require"], None, __file__))
+        local_map.set_default_screen_generator(self.generate_screen)
         return
 
+    def generate(self, y, x, height, width):
+        temperature = numpy.asarray(self.local_map.get_region("temperature", y, x, height, width))
+        moisture = numpy.asarray(self.local_map.get_region("moisture", y, x, height, width))
+        elevation = numpy.asarray(self.local_map.get_region("elevation", y, x, height, width))
+
+        # index of the temperature band, 0 is the hottest
+        band = numpy.zeros(temperature.shape, dtype=numpy.intp)
+        for min_temperature in self.min_temperature:
+            band += temperature < min_temperature
+
+        biomes = numpy.zeros(temperature.shape, dtype=numpy.uint8)
+        for i in range(len(self.band_biomes)):
+            inside = band == i
+            edges = self.max_moisture[i].astype(moisture.dtype)
+            biomes[inside] = self.band_biomes[i][numpy.searchsorted(edges, moisture[inside])]
+
+        ocean = elevation <= self.ocean["max_elevation"]
+        biomes[ocean] = self.ocean["biome"]
+        biomes[ocean & (temperature <= self.ocean["frozen_max_temperature"])] = self.ocean["frozen_biome"]
+        biomes[(~ocean) & (elevation <= self.beach["max_elevation"])] = self.beach["biome"]
+        return biomes
+
+    def generate_screen(self, y, x, height, width):
+        colors = biomecolor[self.local_map.get_region(self.id, y, x, height, width)]
+        return [[[ord(" "), FGN, list(c)] for c in row] for row in colors.tolist()]
+
     def update(self, **kwargs) -> None:
         return
 
@@ -121,7 +109,7 @@ class Biomes:
             return {"title": "World", 0: {"title": "Environment", 0: ["biome: " + self.get_biomename(kwargs["map"].get_attribute_at(self.id, kwargs["mods"]["rpgplayer"].get_position()[0], kwargs["mods"]["rpgplayer"].get_position()[1])), 1, 0]}}
 
     def get_biomesout(self):
-        return self.biomesout
+        return biomecolor[self.local_map.get_attribute(self.id)]
 
     def get_biomename(self, index):
         return biomedict[index]
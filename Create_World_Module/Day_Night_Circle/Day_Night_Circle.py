@@ -1,5 +1,4 @@
 import json
-import copy
 import numpy
 from yapsy.IPlugin import IPlugin
 
@@ -34,23 +33,37 @@ class Day_Night_Circle:
         self.max_alpha = obj["max_alpha"]
         self.color_id = obj["color_id"]
 
-        self.layer = []
-        for y in range(self.height):
-            self.layer.append([0] * self.width)
-            for x in range(self.width):
-                if x <= self.width * self.end_rise:
-                    self.layer[y][x] = (self.max_value - self.min_value) / (self.width * self.end_rise) * \
-                                       x
-                elif x <= self.width * self.begin_set:
-                    self.layer[y][x] = self.max_value
-                elif x <= self.width * self.end_set:
-                    self.layer[y][x] = (self.min_value - self.max_value) / \
-                                       (self.width * (self.end_set - self.begin_set)) * \
-                                       (x - self.width * self.begin_set) + self.max_value
-                else:
-                    self.layer[y][x] = self.min_value
-        self.layer = numpy.array(self.layer)
-        local_map.set_attribute(self.name_of_value, copy.deepcopy(self.layer))
+        # the light only depends on x, one row serves the whole map
+        x = numpy.arange(self.width, dtype=numpy.float64)
+        self.profile = numpy.select(
+            [x <= self.width * self.end_rise, x <= self.width * self.begin_set, x <= self.width * self.end_set],
+            [(self.max_value - self.min_value) / (self.width * self.end_rise) * x,
+             numpy.full(self.width, self.max_value, dtype=numpy.float64),
+             (self.min_value - self.max_value) / (self.width * (self.end_set - self.begin_set)) *
+             (x - self.width * self.begin_set) + self.max_value],
+            self.min_value).astype(numpy.float32)
+        # light row and overlay alpha row by shift, a day only has width shifts
+        self.shifted = {}
+        self.max_shifted = 64
+        # the layer is generated from the current light row, a chunked map only builds the rows it is asked for
+        self.light = self.profile
+        local_map.register_layer(self.name_of_value, numpy.float32)
+        local_map.set_attribute_generator(self.name_of_value, self.generate)
+
+    def generate(self, y, x, height, width):
+        return numpy.repeat(self.light[None, x:x + width], height, axis=0)
+
+    def get_shifted(self, modification):
+        modification = modification % self.width
+        if modification not in self.shifted:
+            if len(self.shifted) >= self.max_shifted:
+                self.shifted.clear()
+            light = numpy.roll(self.profile, -modification)
+            light.flags.writeable = False
+            alpha = (1 - light) * self.max_alpha
+            alpha.flags.writeable = False
+            self.shifted[modification] = [light, alpha]
+        return self.shifted[modification]
 
     def update(self, **kwargs) -> None:
         this_map = kwargs["map"]
@@ -67,22 +80,13 @@ class Day_Night_Circle:
         modification = round(numpy.floor(modification))
         if self.reverse_direction:
             modification = -modification
-        temp_data = this_map.get_attribute(self.name_of_value)
-        for x in range(self.width):
-            if (x + modification) >= self.width:
-                temp_data[:, x] = self.layer[:, x + modification - self.width]
-            elif (x + modification) < 0:
-                temp_data[:, x] = self.layer[:, x + modification + self.width + 1]
-            else:
-                temp_data[:, x] = self.layer[:, x + modification]
-        this_map.set_attribute(self.name_of_value, temp_data)
+        self.light, alpha = self.get_shifted(modification)
+        this_map.set_attribute_generator(self.name_of_value, self.generate)
 
         if self.color_blend:
-            color_blend = []
-            for h in range(self.height):
-                color_blend.append([list(self.color)]*self.width)
-            visual = kwargs["map"].get_attribute(self.name_of_value)
-            visual = [[(1-j)*self.max_alpha for j in i] for i in visual]
+            # read-only broadcast views, the tile copies them before digging holes
+            color_blend = numpy.broadcast_to(numpy.array(self.color), (self.height, self.width, 3))
+            visual = numpy.broadcast_to(alpha, (self.height, self.width))
             kwargs["window"].get(0)[0].color_blend(0, 0, self.height, self.width, color_blend, visual, 4, self.color_id)
 
     def print(self, **kwargs):
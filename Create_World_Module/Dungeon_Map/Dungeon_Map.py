@@ -1,11 +1,14 @@
 from yapsy.IPlugin import IPlugin
 import numpy as np
 import tcod.bsp
+import tcod.console
+import tcod.random
 import random
 import Main_Menu.Create_World_State as mapclass
 import Library.UI as UI
 from typing import List, Tuple, Iterator
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
+from collections import OrderedDict
 
 
 
@@ -16,7 +19,7 @@ TILE_FLOOR = 1
 class Dungeon_Map_Plugin(IPlugin):
     def initialize(self, **kwargs):
         obj = kwargs["obj"]
-        this_mod = Dungeon_Map(obj)
+        this_mod = Dungeon_Map(obj, kwargs["seed"])
         return this_mod
 
 
@@ -30,7 +33,8 @@ class Dungeon_Map_Data:
         width: int,
         max_depth: int,
         min_size: int,
-        floor_config: list
+        floor_config: list,
+        seed: int = None
     ) -> None:
         self.position_y = position_y
         self.position_x = position_x
@@ -42,8 +46,11 @@ class Dungeon_Map_Data:
         # 额外数据 ── reserved 记录“已用 + 缓冲”区域
         self._buffer = 1
         self._reserved = np.zeros_like(self.dungeon_map, dtype=bool)
-        self.screen: list[list[list]] = []
+        self._near = np.zeros_like(self.dungeon_map, dtype=bool)
+        self.screen = None
         self.floor_config = floor_config
+        # 同一种子生成同一地牢
+        self.rand = random.Random(seed)
 
     # --------------------------------------------------------
     # 房间
@@ -59,12 +66,12 @@ class Dungeon_Map_Data:
         if x1_max < x1_min or y1_max < y1_min:
             return None  # 叶子太小
         for _ in range(30):  # 最多尝试 30 次
-            x1 = random.randint(x1_min, x1_max)
-            y1 = random.randint(y1_min, y1_max)
+            x1 = self.rand.randint(x1_min, x1_max)
+            y1 = self.rand.randint(y1_min, y1_max)
             w_max = node.x + node.width  - x1 - self._buffer
             h_max = node.y + node.height - y1 - self._buffer
-            w = random.randint(self.min_size, w_max)
-            h = random.randint(self.min_size, h_max)
+            w = self.rand.randint(self.min_size, w_max)
+            h = self.rand.randint(self.min_size, h_max)
             x2, y2 = x1 + w, y1 + h  # 右下角(不含)
             # 检查区域 (含缓冲) 是否为空
             if self._reserved[y1 - self._buffer : y2 + self._buffer,
@@ -72,8 +79,7 @@ class Dungeon_Map_Data:
                 continue
             # 挖房
             self.dungeon_map[y1:y2, x1:x2] = 1
-            self._reserved[y1 - self._buffer : y2 + self._buffer,
-                           x1 - self._buffer : x2 + self._buffer] = True
+            self._reserve(y1 - self._buffer, y2 + self._buffer, x1 - self._buffer, x2 + self._buffer)
             cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
             node.room_center = (cx, cy)
             return (cx, cy)
@@ -89,43 +95,50 @@ class Dungeon_Map_Data:
         """
         ax, ay = a
         bx, by = b
-        def cells(order: str) -> list[tuple[int, int]]:
+        def segments(order: str) -> list[tuple[int, int, int, int]]:
+            # 每段为 (y0, y1, x0, x1)，均含端点
             if order == "h":  # 先横后竖
-                hor = [(x, ay) for x in range(min(ax, bx), max(ax, bx) + 1)]
-                ver = [(bx, y) for y in range(min(ay, by), max(ay, by) + 1)]
+                return [(ay, ay, min(ax, bx), max(ax, bx)), (min(ay, by), max(ay, by), bx, bx)]
             else:            # 先竖后横
-                ver = [(ax, y) for y in range(min(ay, by), max(ay, by) + 1)]
-                hor = [(x, by) for x in range(min(ax, bx), max(ax, bx) + 1)]
-            return hor + ver
-        def ok(c_list: list[tuple[int, int]]) -> bool:
-            for x, y in c_list:
-                ys = slice(max(0, y - self._buffer), min(self.height, y + self._buffer + 1))
-                xs = slice(max(0, x - self._buffer), min(self.width,  x + self._buffer + 1))
-                if self._reserved[ys, xs].any() and (x, y) not in (a, b):
+                return [(min(ay, by), max(ay, by), ax, ax), (by, by, min(ax, bx), max(ax, bx))]
+        def ok(segment_list: list[tuple[int, int, int, int]]) -> bool:
+            # _near 为 reserved 膨胀 buffer 圈后的掩码，路线上（两端点除外）不得碰到
+            for y0, y1, x0, x1 in segment_list:
+                hit = self._near[y0:y1 + 1, x0:x1 + 1].copy()
+                for x, y in (a, b):
+                    if y0 <= y <= y1 and x0 <= x <= x1:
+                        hit[y - y0, x - x0] = False
+                if hit.any():
                     return False
             return True
         orders = ["h", "v"]
-        random.shuffle(orders)
+        self.rand.shuffle(orders)
         for o in orders:
-            c_list = cells(o)
-            if ok(c_list):
-                self._dig_path(c_list)
+            segment_list = segments(o)
+            if ok(segment_list):
+                self._dig_path(segment_list)
                 return
         # 若均失败，强行使用第一种
-        self._dig_path(cells(orders[0]), strict=False)
+        self._dig_path(segments(orders[0]), strict=False)
 
-    def _dig_path(self, coord_list: list[tuple[int, int]], *, strict: bool = True):
+    def _reserve(self, y0: int, y1: int, x0: int, x1: int):
         """
-        将 coord_list 中的格子全部挖开，并把“格子+缓冲圈”记为 reserved。
+        将 [y0:y1, x0:x1] 记为 reserved，并同步更新膨胀后的 _near。
+        """
+        self._reserved[max(0, y0):y1, max(0, x0):x1] = True
+        self._near[max(0, y0 - self._buffer):y1 + self._buffer, max(0, x0 - self._buffer):x1 + self._buffer] = True
+
+    def _dig_path(self, segment_list: list[tuple[int, int, int, int]], *, strict: bool = True):
+        """
+        将各段格子全部挖开，并把“格子+缓冲圈”记为 reserved。
         strict=True 表示信任该路线已与 reserved 不冲突；False 则忽略检查。
         """
-        for x, y in coord_list:
+        for y0, y1, x0, x1 in segment_list:
             if strict:
-                ys = slice(max(0, y - self._buffer), min(self.height, y + self._buffer + 1))
-                xs = slice(max(0, x - self._buffer), min(self.width,  x + self._buffer + 1))
-                self._reserved[ys, xs] = True
-            self.dungeon_map[y, x] = 1
-            self._reserved[y, x] = True
+                self._reserve(y0 - self._buffer, y1 + 1 + self._buffer, x0 - self._buffer, x1 + 1 + self._buffer)
+            else:
+                self._reserve(y0, y1 + 1, x0, x1 + 1)
+            self.dungeon_map[y0:y1 + 1, x0:x1 + 1] = 1
 
     # --------------------------------------------------------
     # 生成过程
@@ -137,6 +150,7 @@ class Dungeon_Map_Data:
             self.min_size + 2 * self._buffer,
             1.5,
             1.5,
+            seed=tcod.random.Random(seed=self.rand.randint(0, 2147483647)),
         )
         # 1. 叶子 -> 房间
         for node in root.pre_order():
@@ -149,7 +163,7 @@ class Dungeon_Map_Data:
             left, right = node.children
             if hasattr(left, "room_center") and hasattr(right, "room_center"):
                 self.carve_corridor(left.room_center, right.room_center)
-                node.room_center = random.choice((left.room_center, right.room_center))
+                node.room_center = self.rand.choice((left.room_center, right.room_center))
 
     # --------------------------------------------------------
     # 入口
@@ -159,12 +173,12 @@ class Dungeon_Map_Data:
         不需要缓冲检查，直接贯通外部世界。
         """
         edges = [
-            ("top",    (lambda: (random.randint(1, self.width - 2), 0),              (0, 1))),
-            ("bottom", (lambda: (random.randint(1, self.width - 2), self.height - 1),(0, -1))),
-            ("left",   (lambda: (0,              random.randint(1, self.height - 2)),(1, 0))),
-            ("right",  (lambda: (self.width - 1, random.randint(1, self.height - 2)),(-1, 0))),
+            ("top",    (lambda: (self.rand.randint(1, self.width - 2), 0),              (0, 1))),
+            ("bottom", (lambda: (self.rand.randint(1, self.width - 2), self.height - 1),(0, -1))),
+            ("left",   (lambda: (0,              self.rand.randint(1, self.height - 2)),(1, 0))),
+            ("right",  (lambda: (self.width - 1, self.rand.randint(1, self.height - 2)),(-1, 0))),
         ]
-        random.shuffle(edges)
+        self.rand.shuffle(edges)
         for _name, (pos_fn, step) in edges:
             ex, ey = pos_fn()
             dx, dy = step
@@ -179,31 +193,101 @@ class Dungeon_Map_Data:
 
     # --------------------------------------------------------
     # 对外接口
-    def get_dungeon_map(self):
+    def get_dungeon_map(self, stairs_char: str = None):
         """
         生成整图，构造 screen 结构并返回
         [MapData, numpy_map, 入口坐标]
+        给出 stairs_char 时另选一格地板作为下楼梯，坐标记在 self.stairs
         """
         self.generate()
         entrance = self.add_entrance()
-        self.screen.clear()
-        for y in range(self.height):
-            row = []
-            for x in range(self.width):
-                if self.dungeon_map[y, x] == 1:
-                    row.append([self.floor_config[0], self.floor_config[1], self.floor_config[2]])
-                else:
-                    row.append([self.floor_config[3], self.floor_config[4], self.floor_config[5]])
-            self.screen.append(row)
+        self.stairs = None
+        if stairs_char is not None:
+            floor_y, floor_x = np.nonzero(self.dungeon_map)
+            away = (floor_y != entrance[1]) | (floor_x != entrance[0])
+            index = self.rand.randrange(int(away.sum()))
+            self.stairs = (int(floor_y[away][index]), int(floor_x[away][index]))
+        # reserved 只在生成时使用
+        self._reserved = None
+        self._near = None
+        # 两格查找表，按 dungeon_map 取值得到整张 screen
+        tiles = np.zeros(2, dtype=tcod.console.rgb_graphic)
+        tiles[TILE_FLOOR] = (ord(self.floor_config[0]), self.floor_config[1], self.floor_config[2])
+        tiles[TILE_WALL] = (ord(self.floor_config[3]), self.floor_config[4], self.floor_config[5])
+        self.screen = tiles[self.dungeon_map]
+        if self.stairs is not None:
+            self.screen["ch"][self.stairs] = ord(stairs_char)
 
         pass_enter = [[entrance[1], entrance[0]]]
-        submap = mapclass.MapData(self.height, self.width, enter_point=list(pass_enter), walkable=list(self.dungeon_map), exit_point=list(pass_enter))
+        submap = mapclass.MapData(self.height, self.width, enter_point=list(pass_enter), walkable=self.dungeon_map, exit_point=list(pass_enter))
         submap.set_default_screen(self.screen)
         return submap
 
 
+# 最近进入的若干层地牢，超出数量时丢弃最久未进入的一层，再次进入时按种子重新生成
+class Dungeon_Level_Cache:
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.levels = OrderedDict()
+
+    def get(self, key, generate) -> mapclass.MapData:
+        if key in self.levels:
+            self.levels.move_to_end(key)
+            return self.levels[key]
+        level = generate()
+        self.levels[key] = level
+        while len(self.levels) > self.size:
+            self.levels.popitem(last=False)
+        return level
+
+    # 存档时不保存缓存的层
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["levels"] = OrderedDict()
+        return state
+
+
+# 未进入的地牢层只记录位置、种子与参数，进入时再按种子生成；非最底层在下楼梯处挂下一层的 stub
+@dataclass
+class Dungeon_Stub:
+    position_y: int
+    position_x: int
+    seed: int
+    height: int
+    width: int
+    max_depth: int
+    min_size: int
+    floor_config: list
+    view_dist: int
+    module_id: str = "dungeon_map"
+    levels: int = 1
+    depth: int = 0
+    stairs_char: str = ">"
+    cache: Dungeon_Level_Cache = field(default=None, repr=False, compare=False)
+
+    def open(self, **kwargs) -> mapclass.MapData:
+        if self.cache is None:
+            return self.generate()
+        return self.cache.get((self.seed, self.depth), self.generate)
+
+    # 每个地牢的每一层由 (种子, 层数) 派生独立的种子；用 seed + depth 会让相邻种子的地牢共用层
+    def level_seed(self) -> int:
+        return int(np.random.SeedSequence([self.seed, self.depth]).generate_state(1)[0])
+
+    def generate(self) -> mapclass.MapData:
+        deeper = self.depth + 1 < self.levels
+        dungeon_map_data = Dungeon_Map_Data(self.position_y, self.position_x, self.height, self.width,
+                                            self.max_depth, self.min_size, self.floor_config, self.level_seed())
+        submap = dungeon_map_data.get_dungeon_map(self.stairs_char if deeper else None)
+        submap._view_dist = self.view_dist
+        if deeper:
+            stairs_y, stairs_x = dungeon_map_data.stairs
+            submap.set_submap(stairs_y, stairs_x, "stairs down", self.module_id, replace(self, depth=self.depth + 1))
+        return submap
+
+
 class Dungeon_Map:
-    def __init__(self, obj) -> None:
+    def __init__(self, obj, seed=None) -> None:
         self.id = obj["id"]
         self.number_of_dungeon = obj["number_of_dungeon"]
         self.dmap_width = obj["dmap_width"]
@@ -213,12 +297,15 @@ class Dungeon_Map:
         self.icon = obj["icon"]
         self.icon_color = obj["icon_color"]
         self.biome_exception = obj["biome_exception"]
+        self.levels = obj["levels"]
+        self.stairs_char = obj["stairs_char"]
+        self.level_cache = Dungeon_Level_Cache(obj["resident_levels"])
 
         self.initiate_dungeon_map = False
         self.dungeon_maps = []
+        self.rand = random.Random(seed)
 
         self.player_id = obj["player_id"]
-        self.list_submap = []
         self.start_view_dist = obj["start_view_dist"]
 
         self.road_char = obj["road_char"],
@@ -241,15 +328,14 @@ class Dungeon_Map:
             maps = kwargs["map"]
             generated = 0
             while generated < self.number_of_dungeon:
-                n = random.randint(0, maps.get_height() - 1)
-                m = random.randint(0, maps.get_width() - 1)
+                n = self.rand.randint(0, maps.get_height() - 1)
+                m = self.rand.randint(0, maps.get_width() - 1)
                 if maps.get_attribute_at("biomes", n, m) != self.biome_exception:
-                    dungeon_map_data = Dungeon_Map_Data(n, m, self.dmap_height, self.dmap_width, self.max_depth, self.min_size, self.floor_config)
-                    self.dungeon_maps.append(dungeon_map_data)
-                    submap = dungeon_map_data.get_dungeon_map()
-                    submap._view_dist = self.start_view_dist
-                    self.list_submap.append(submap)
-                    maps.set_submap(n, m, "dungeon entrance", self.id, submap)
+                    stub = Dungeon_Stub(n, m, self.rand.randint(0, 2147483647), self.dmap_height, self.dmap_width,
+                                        self.max_depth, self.min_size, self.floor_config, self.start_view_dist,
+                                        self.id, self.levels, 0, self.stairs_char, self.level_cache)
+                    self.dungeon_maps.append(stub)
+                    maps.set_submap(n, m, "dungeon entrance", self.id, stub)
                     UI.ntcod_entity(self.icon, self.icon_color, n, m, kwargs["window"].get(0)[0], self.id)
                     generated += 1
             self.initiate_dungeon_map = True
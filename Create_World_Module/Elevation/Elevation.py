@@ -1,5 +1,6 @@
 from yapsy.IPlugin import IPlugin
 import json
+import numpy
 
 
 class Elevation_Plugin(IPlugin):
@@ -13,11 +14,17 @@ class Elevation_Plugin(IPlugin):
 class Elevation:
     def __init__(self, obj, local_map) -> None:
         self.id = obj["id"]
-        elevation_above_ocean = obj["elevation_above_ocean"]
-        elevation = local_map.get_attribute("raw_elevation") * elevation_above_ocean * 10 / 9 - elevation_above_ocean / 9
-        local_map.set_attribute(self.id, elevation)
+        self.elevation_above_ocean = obj["elevation_above_ocean"]
+        self.local_map = local_map
+        local_map.register_layer(self.id, numpy.float32)
+        local_map.set_attribute_generator(self.id, self.generate,
+                                          local_map.make_layer_key("Elevation", obj, obj["Require"], None, __file__))
         return
 
+    def generate(self, y, x, height, width):
+        raw_elevation = self.local_map.get_region("raw_elevation", y, x, height, width)
+        return raw_elevation * self.elevation_above_ocean * 10 / 9 - self.elevation_above_ocean / 9
+
     def update(self, **kwargs) -> None:
         return
 
@@ -1,5 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
 import numpy
-from scipy.ndimage.measurements import label
+from scipy.ndimage import label, find_objects
 from yapsy.IPlugin import IPlugin
 
 from Library import UI
@@ -9,67 +10,120 @@ class Map_Feature_Extraction_Plugin(IPlugin):
     def initialize(self, **kwargs):
         local_map = kwargs["map"]
         obj = kwargs["obj"]
-        this_mod = Map_Feature_Extraction(local_map, obj)
+        this_mod = Map_Feature_Extraction(local_map, obj, kwargs["seed"])
         return this_mod
 
 
 class Map_Feature_Extraction:
-    def __init__(self, local_map, obj) -> None:
+    def __init__(self, local_map, obj, seed=None) -> None:
         self.id = obj["id"]
-        elevation = obj['elevation']
-        biome = obj['biome']
-        self.feature = obj['feature']
-        names = obj['names']
-        self.showonmap = obj["show_on_map"]
-        self.icononmap = obj["icon_on_map"]
+        # every definition of features becomes its own label layer
+        # a config of the older format is itself the one definition
+        self.single = "features" not in obj
+        if self.single:
+            self.features = [obj]
+        else:
+            self.features = obj["features"]
         self.addedicon = False
-        self.icon_color = obj["icon_color"]
 
+        # the labels live only in the map layers, the plugin keeps what it found out about them
         self.database = {}
-        self.labeled = []
-
-        if elevation:
-            self.percentile_of_elevation = obj['percentile_of_elevation']
-            elevation = local_map.get_attribute('elevation')
-            feature_layer = elevation > numpy.percentile(elevation, (1-self.percentile_of_elevation) * 100)
-        elif biome:
-            biomes = local_map.get_attribute('biomes')
-            feature_layer = biomes == obj['feature_index']
-            invert = obj['index_invert']
-            if invert:
-                feature_layer = biomes != obj['feature_index']
-
-        self.labeled, number_feature = label(input=feature_layer)
-        if number_feature < len(names):
-            feat_names = numpy.random.choice(names, number_feature, False)
-            for i in range(number_feature):
-                j = i + 1
-                posi = numpy.transpose((self.labeled == j).nonzero())
-                self.database[len(self.database)] = {
-                    "module": "Map_Feature", "feature": self.feature, "feat_id": j,
-                    "feat_name": feat_names[i],
-                    "position": posi[numpy.random.randint(0, len(posi))]
-                }
-        else:
-            feat_names = numpy.random.choice(names, len(names), False)
-            for i in range(len(names)):
+
+        # the source layers are read once for all definitions
+        sources = {}
+        if any(definition["elevation"] for definition in self.features):
+            sources["elevation"] = local_map.get_attribute('elevation')
+        if any(definition["biome"] for definition in self.features):
+            sources["biomes"] = local_map.get_attribute('biomes')
+
+        with ThreadPoolExecutor(max_workers=obj.get("workers", 1)) as pool:
+            results = list(pool.map(lambda definition: self.extract(definition, sources), self.features))
+
+        for index in range(len(self.features)):
+            definition = self.features[index]
+            labeled, number_feature, stats = results[index]
+            results[index] = None
+            feature = definition["feature"]
+            names = definition["names"]
+            # each definition draws from its own stream, so adding a definition does not rename the others,
+            # a config of the older format keeps its old stream
+            if self.single:
+                rand = numpy.random.RandomState(seed)
+            else:
+                rand = numpy.random.RandomState(None if seed is None else [seed, index])
+            number_named = min(number_feature, len(names))
+            feat_names = rand.choice(names, number_named, False)
+            for i in range(number_named):
                 j = i + 1
-                posi = numpy.transpose((self.labeled == j).nonzero())
+                size = stats["size"][j]
+                first = stats["start"][j]
                 self.database[len(self.database)] = {
-                    "module": "Map_Feature", "feature": self.feature, "feat_id": j,
+                    "module": "Map_Feature", "feature": feature, "feat_id": j,
                     "feat_name": feat_names[i],
-                    "position": posi[numpy.random.randint(0, len(posi))]
+                    "position": stats["position"][first + rand.randint(0, size)],
+                    "size": int(size),
+                    "bbox": stats["bbox"][j],
+                    "centroid": stats["centroid"][j]
                 }
-        local_map.set_attribute(self.feature, self.labeled)
+            local_map.register_layer(feature, numpy.int32)
+            local_map.set_attribute(feature, labeled)
+
+    @staticmethod
+    def feature_mask(definition, sources):
+        if definition["elevation"]:
+            elevation = sources["elevation"]
+            return elevation > numpy.percentile(elevation, (1 - definition['percentile_of_elevation']) * 100)
+        elif definition["biome"]:
+            if definition['index_invert']:
+                return sources["biomes"] != definition['feature_index']
+            return sources["biomes"] == definition['feature_index']
+        raise ValueError("feature " + definition["feature"] + " is neither an elevation nor a biome feature")
+
+    def extract(self, definition, sources):
+        labeled, number_feature = label(input=self.feature_mask(definition, sources), output=numpy.int32)
+        labeled, number_feature = self.drop_small(labeled, number_feature, definition.get("min_area", 1))
+        return labeled, number_feature, self.feature_stats(labeled, number_feature)
+
+    # features smaller than min_area go back to the background, the rest are numbered 1..n again
+    @staticmethod
+    def drop_small(labeled, number_feature, min_area):
+        if min_area <= 1:
+            return labeled, number_feature
+        kept = numpy.bincount(labeled.ravel(), minlength=number_feature + 1)[1:] >= min_area
+        remap = numpy.zeros(number_feature + 1, dtype=labeled.dtype)
+        remap[1:][kept] = numpy.arange(1, kept.sum() + 1, dtype=labeled.dtype)
+        return remap[labeled], int(kept.sum())
+
+    # sizes, bounding boxes and centroids of all labels in one pass, and the cells of label j
+    # as position[start[j]:start[j] + size[j]] in row-major order
+    @staticmethod
+    def feature_stats(labeled, number_feature):
+        width = labeled.shape[1]
+        flat = labeled.ravel()
+        cells = numpy.flatnonzero(flat)
+        cells = cells[numpy.argsort(flat[cells], kind="stable")]
+        rows, columns = numpy.divmod(cells, width)
+        size = numpy.bincount(flat[cells], minlength=number_feature + 1)
+        start = numpy.concatenate(([0, 0], numpy.cumsum(size[1:])))
+        centroid_y = numpy.bincount(flat[cells], weights=rows, minlength=number_feature + 1)
+        centroid_x = numpy.bincount(flat[cells], weights=columns, minlength=number_feature + 1)
+        bbox = {}
+        centroid = {}
+        for j, box in enumerate(find_objects(labeled, number_feature), 1):
+            bbox[j] = [box[0].start, box[1].start, box[0].stop, box[1].stop]
+            centroid[j] = [centroid_y[j] / size[j], centroid_x[j] / size[j]]
+        return {"size": size, "start": start, "position": numpy.stack((rows, columns), axis=1),
+                "bbox": bbox, "centroid": centroid}
 
     def update(self, **kwargs) -> None:
         if not self.addedicon:
-            if self.showonmap:
-                for i in range(kwargs["map"].get_height()):
-                    for j in range(kwargs["map"].get_width()):
-                        if self.labeled[i][j] != 0:
-                            this_icon = UI.ntcod_entity(self.icononmap, self.icon_color, i, j, kwargs["window"].get(0)[0], self.feature)
-                self.addedicon = True
+            for definition in self.features:
+                if definition["show_on_map"]:
+                    feature = definition["feature"]
+                    for i, j in numpy.transpose(kwargs["map"].get_attribute(feature).nonzero()):
+                        this_icon = UI.ntcod_entity(definition["icon_on_map"], definition["icon_color"], i, j,
+                                                    kwargs["window"].get(0)[0], feature)
+            self.addedicon = True
         return
 
     def print(self, **kwargs):
@@ -77,17 +131,24 @@ class Map_Feature_Extraction:
             mods = kwargs["mods"]
             posi_x = mods["rpgplayer"].get_position()[1]
             posi_y = mods["rpgplayer"].get_position()[0]
-            label_layer = kwargs["map"].get_attribute(self.feature)
 
-            location_feat = label_layer[posi_y][posi_x]
-            if location_feat != 0:
-                for id, items in self.database.items():
-                    if items["module"] == "Map_Feature":
-                        if (items["feature"] == self.feature) and (items["feat_id"] == location_feat):
-                            return {"title": "World", 0: {"title": "Environment", 0: [self.feature + ": " + items["feat_name"], 1, 0]}}
+            lines = {"title": "Environment"}
+            for definition in self.features:
+                feature = definition["feature"]
+                location_feat = kwargs["map"].get_attribute_at(feature, posi_y, posi_x)
+                if location_feat != 0:
+                    for id, items in self.database.items():
+                        if items["module"] == "Map_Feature":
+                            if (items["feature"] == feature) and (items["feat_id"] == location_feat):
+                                lines[len(lines) - 1] = [feature + ": " + items["feat_name"], 1, 0]
+            if len(lines) > 1:
+                return {"title": "World", 0: lines}
 
     def get_feat_name(self):
-        return self.feature
+        return self.features[0]["feature"]
+
+    def get_feat_names(self):
+        return [definition["feature"] for definition in self.features]
 
     def get_actions(self, **kwargs):
         return
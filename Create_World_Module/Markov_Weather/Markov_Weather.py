@@ -6,19 +6,19 @@ from scipy.ndimage import uniform_filter
 from scipy.stats import mode
 import Library.UI
 from Library import UI
-from Library.UI import FGN
+from Library.Parallel import BandPool, sample_categorical
 
 
 class Markov_Weather_Plugin(IPlugin):
     def initialize(self, **kwargs):
         local_map = kwargs["map"]
         obj = kwargs["obj"]
-        this_mod = Markov_Weather(local_map, obj)
+        this_mod = Markov_Weather(local_map, obj, kwargs["seed"])
         return this_mod
 
 
 class Markov_Weather:
-    def __init__(self, local_map, obj) -> None:
+    def __init__(self, local_map, obj, seed=None) -> None:
         self.id = obj["id"]
         self.category = obj['category']
         self.markov_factor = obj['markov_factor']
@@ -33,14 +33,22 @@ class Markov_Weather:
         self.visual = []
         self.showcloud = obj["show_cloud"]
         self.cloudid = obj["cloud_id"]
-        for i in range(local_map.get_height()):
-            self.color_blend.append([FGN] * local_map.get_width())
-            self.visual.append([0] * local_map.get_width())
-
-        weather_map = []
-        for i in range(local_map.get_height()):
-            weather_map.append([default] * local_map.get_width())
-        weather_map = np.array(weather_map)
+        self.rng = np.random.default_rng(seed)
+        # with several workers every weather change gets fresh band streams from the seed and the change index
+        self.seed = seed
+        self.sampled = 0
+        self.band_pool = None
+        if obj["workers"] > 1:
+            self.band_pool = BandPool(obj["workers"])
+        # side of the square of tiles that share one weather cell, 1 simulates every tile
+        self.coarse_factor = obj["coarse_factor"]
+        self.coarse_weather = None
+        if self.coarse_factor > 1:
+            self.coarse_weather = np.full((-(-local_map.get_height() // self.coarse_factor),
+                                           -(-local_map.get_width() // self.coarse_factor)), default, dtype=np.uint8)
+
+        weather_map = np.full((local_map.get_height(), local_map.get_width()), default, dtype=np.uint8)
+        local_map.register_layer(self.category, np.uint8)
         local_map.set_attribute(self.category, weather_map)
 
         self.default_transition_matrix = []
@@ -69,78 +77,133 @@ class Markov_Weather:
                         self.default_transition_matrix[i, j] = (100 - self.steady_state_weight) / 2
                     else:
                         self.default_transition_matrix[i, j] = (100 - self.normal_weight) / 2
+        self.probability = self.transition_tables()
+        self.cumulative = self.to_cumulative(self.probability)
+        self.powers = {}
+
+        # cloud overlay color and alpha by weather type
+        self.cloud_color = np.full((max(len(self.types), 9), 3), 217, dtype=np.int32)
+        self.cloud_alpha = np.zeros(max(len(self.types), 9), dtype=np.int32)
+        self.cloud_color[3:6] = 255
+        self.cloud_alpha[3:6] = [100, 130, 160]
+        self.cloud_alpha[6] = 160
+        self.cloud_color[7] = 153
+        self.cloud_alpha[7] = 140
+        self.cloud_color[8] = 76
+        self.cloud_alpha[8] = 140
         self.counter = 0
 
+    # distribution of the next weather for every (current weather, moisture target) pair
+    def transition_tables(self):
+        number = len(self.types)
+        distance = np.abs(np.arange(number)[None, :] - np.arange(number)[:, None])
+        # weight[t, x] pulls the chain towards the target t of the cell
+        weight = 1 + 1 / (distance + 1)
+        probability = self.default_transition_matrix[:, None, :] * weight[None, :, :]
+        return probability / probability.sum(axis=2, keepdims=True)
+
+    @staticmethod
+    def to_cumulative(probability):
+        cumulative = np.cumsum(probability, axis=2)
+        cumulative[:, :, -1] = 1.0
+        return cumulative
+
+    # cumulative tables of several changes in a row, the matrix power of each target's chain
+    def power_tables(self, changes):
+        if changes not in self.powers:
+            if len(self.powers) >= 64:
+                self.powers.clear()
+            probability = np.stack([np.linalg.matrix_power(self.probability[:, target, :], changes)
+                                    for target in range(len(self.types))], axis=1)
+            self.powers[changes] = self.to_cumulative(probability)
+        return self.powers[changes]
+
+    # chance that a step of the timeline changes the weather, as a roll of 0-99 under step_probability
+    def get_change_probability(self, time):
+        total_period = time.get_settings()[self.circle_level_index]
+        average_time_per_change = total_period / self.changes_per_level
+        step_probability = (1 / average_time_per_change) * 100
+        return min(max(np.ceil(step_probability), 0), 100) / 100
+
+    # probability of each weather type at a position after a number of steps
+    def forecast(self, local_map, time, y, x, steps):
+        number = len(self.types)
+        if self.changes_per_level == 0:
+            change_probability = 0
+        else:
+            change_probability = self.get_change_probability(time)
+        if self.coarse_weather is None:
+            target = self.get_targets(local_map.get_attribute_at(self.markov_factor, y, x))
+        else:
+            target = self.get_coarse_targets(local_map.get_attribute(self.markov_factor))[
+                y // self.coarse_factor, x // self.coarse_factor]
+        step = (1 - change_probability) * np.eye(number) + change_probability * self.probability[:, target, :]
+        return np.linalg.matrix_power(step, steps)[local_map.get_attribute_at(self.category, y, x)]
+
+    def get_targets(self, factor_map):
+        return np.rint(np.asarray(factor_map) * (len(self.types) - 1)).astype(np.intp)
+
+    # targets of the weather cells from the mean factor of their tiles, edge cells repeat the last tiles
+    def get_coarse_targets(self, factor_map):
+        factor_map = np.asarray(factor_map, dtype=np.float64)
+        height, width = self.coarse_weather.shape
+        padded = np.pad(factor_map, ((0, height * self.coarse_factor - factor_map.shape[0]),
+                                     (0, width * self.coarse_factor - factor_map.shape[1])), mode="edge")
+        mean = padded.reshape(height, self.coarse_factor, width, self.coarse_factor).mean(axis=(1, 3))
+        return self.get_targets(mean)
+
+    def upsample(self, coarse, height, width):
+        return np.repeat(np.repeat(coarse, self.coarse_factor, axis=0), self.coarse_factor, axis=1)[0:height, 0:width]
+
+    def sample(self, weather_map, targets, cumulative):
+        self.sampled += 1
+        if self.band_pool is None:
+            return sample_categorical(weather_map, targets, cumulative, self.rng)
+        if self.seed is None:
+            seed_sequence = np.random.SeedSequence()
+        else:
+            seed_sequence = np.random.SeedSequence([self.seed, self.sampled])
+        return self.band_pool.sample_categorical(weather_map, targets.astype(np.uint8), cumulative, seed_sequence)
+
     def update(self, **kwargs) -> None:
         self.counter = 0
         if self.changes_per_level == 0:
             return
 
         time = kwargs["mods"]["timeline"]
-        total_period = time.get_settings()[self.circle_level_index]
-        average_time_per_change = total_period / self.changes_per_level
-        step_probability = (1 / average_time_per_change) * 100
-
         time_passed = time.get_whole_steps() if self.circle_level_index == 0 else time.get_changes()[
             self.circle_level_index]
         if time_passed == 0:
             return
 
+        # every step changes the whole map with the same chance, so the number of changes is binomial
+        # and a cell's final weather follows the matching power of its chain
+        changes = int(self.rng.binomial(time_passed, self.get_change_probability(time)))
+        if changes == 0:
+            return
+        self.counter = changes
+
         map_obj = kwargs["map"]
-        weather_map = map_obj.get_attribute(self.category)
         factor_map = map_obj.get_attribute(self.markov_factor)
         height = map_obj.get_height()
         width = map_obj.get_width()
 
-        weather_changed = False
-        for _ in range(time_passed):
-            fate = np.random.randint(0, 100)
-            if fate < step_probability:
-                weather_changed = True
-                self.counter += 1
-
-                for i in range(height):
-                    for j in range(width):
-                        current_weather = weather_map[i, j]
-                        probability = self.default_transition_matrix[current_weather].copy()
-
-                        factor = factor_map[i, j]
-                        target = round(factor * (len(self.types) - 1))
-                        for x, val in enumerate(probability):
-                            probability[x] *= 1 + 1 / (abs(x - target) + 1)
-
-                        probability = probability / probability.sum()
-                        weather_map[i, j] = np.random.choice(len(self.types), p=probability)
-
-                map_obj.set_attribute(self.category, weather_map)
-
-        if self.showcloud and weather_changed:
+        if changes == 1:
+            cumulative = self.cumulative
+        else:
+            cumulative = self.power_tables(changes)
+        if self.coarse_weather is None:
+            weather_map = map_obj.get_writable_attribute(self.category)
+            weather_map = self.sample(weather_map, self.get_targets(factor_map), cumulative)
+            map_obj.commit_attribute(self.category, weather_map)
+        else:
+            self.coarse_weather = self.sample(self.coarse_weather, self.get_coarse_targets(factor_map), cumulative)
+            map_obj.set_attribute(self.category, self.upsample(self.coarse_weather, height, width))
+
+        if self.showcloud:
             updated_map = map_obj.get_attribute(self.category)
-            for i in range(height):
-                for j in range(width):
-                    w = updated_map[i][j]
-                    if w == 3:
-                        self.color_blend[i][j] = [255, 255, 255]
-                        self.visual[i][j] = 100
-                    elif w == 4:
-                        self.color_blend[i][j] = [255, 255, 255]
-                        self.visual[i][j] = 130
-                    elif w == 5:
-                        self.color_blend[i][j] = [255, 255, 255]
-                        self.visual[i][j] = 160
-                    elif w == 6:
-                        self.color_blend[i][j] = [217, 217, 217]
-                        self.visual[i][j] = 160
-                    elif w == 7:
-                        self.color_blend[i][j] = [153, 153, 153]
-                        self.visual[i][j] = 140
-                    elif w == 8:
-                        self.color_blend[i][j] = [76, 76, 76]
-                        self.visual[i][j] = 140
-                    else:
-                        self.color_blend[i][j] = [217, 217, 217]
-                        self.visual[i][j] = 0
-
+            self.color_blend = self.cloud_color[updated_map]
+            self.visual = self.cloud_alpha[updated_map]
             kwargs["window"].get(0)[0].color_blend(0, 0, height, width, self.color_blend, self.visual, 3, self.cloudid)
 
 
@@ -1,86 +1,192 @@
 from yapsy.IPlugin import IPlugin
 import json
 import random
+import threading
+import zlib
+from collections import OrderedDict
 import numpy
 import tcod
+from Library.Cache import companion_key
+
+
+# weighted mean of noise layers mapped to 0..1, added up block by block into one float32 array
+def layered_noise(noise_gen, layers, total_weight, y, x, height, width, step=1, block=128):
+    value = numpy.zeros((height, width), dtype=numpy.float32)
+    for start in range(0, height, block):
+        rows = min(block, height - start)
+        for this_layer in range(len(layers)):
+            weight, scale = layers[str(this_layer)]
+            octave = noise_gen[this_layer][tcod.noise.grid(shape=(width, rows), scale=scale * step,
+                                                           origin=(x * scale, (y + start * step) * scale))]
+            octave += 1.0
+            octave *= weight * 0.5 / total_weight
+            value[start:start + rows] += octave
+    return value
 
 
 class Noise_Layer_Plugin(IPlugin):
     def initialize(self, **kwargs):
         local_map = kwargs["map"]
         obj = kwargs["obj"]
-        this_mod = Noise_Layer(local_map, obj)
+        this_mod = Noise_Layer(local_map, obj, kwargs["seed"])
         return this_mod
 
 
+# seamless noise over the infinite plane, the same seed gives the same value at the same position
+class Noise_Plane:
+    def __init__(self, obj, seed) -> None:
+        self.layers = obj["layers"]
+        self.power = obj["power"]
+        self.resize = obj["resize"]
+        # "layers" sums one noise per weighted layer, "fbm" leaves the octaves to tcod
+        self.implementation = obj["implementation"]
+        self.seed = seed
+
+        rand = random.Random(seed)
+        self.noise_gen = []
+        self.total_weight = 0
+        if self.implementation == "fbm":
+            self.fbm = obj["fbm"]
+            self.noise_gen.append(tcod.noise.Noise(dimensions=2, implementation=tcod.noise.Implementation.FBM,
+                                                   hurst=self.fbm["hurst"], lacunarity=self.fbm["lacunarity"],
+                                                   octaves=self.fbm["octaves"], seed=rand.randint(0, 2147483647)))
+        elif self.implementation == "layers":
+            for this_layer in range(len(self.layers)):
+                self.noise_gen.append(tcod.noise.Noise(dimensions=2, seed=rand.randint(0, 2147483647)))
+                self.total_weight = self.total_weight + self.layers[str(this_layer)][0]
+        else:
+            raise ValueError("unknown noise implementation " + str(self.implementation))
+
+        # the resize range may be declared in the config, otherwise it is taken from the first values generated
+        self.value_range = obj.get("value_range")
+        # recently sampled tiles, least recently used first
+        self.tile_size = 64
+        self.max_tiles = 256
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+
+    # weighted noise in 0..1 raised to power, every layer is added into one float32 array
+    def raw_value(self, y, x, height, width, step=1):
+        if self.implementation == "fbm":
+            value = layered_noise(self.noise_gen, {"0": [1, self.fbm["scale"]]}, 1, y, x, height, width, step)
+        else:
+            value = layered_noise(self.noise_gen, self.layers, self.total_weight, y, x, height, width, step)
+        numpy.clip(value, 0, 1, out=value)
+        numpy.power(value, self.power, out=value)
+        return value
+
+    # resize range from a coarse sample of the rectangle at the origin
+    def estimate_range(self, height, width):
+        step = max(1, max(height, width) // 256)
+        value = self.raw_value(0, 0, -(-height // step), -(-width // step), step)
+        return [value.min(), value.max()]
+
+    def generate(self, y, x, height, width):
+        value = self.raw_value(y, x, height, width)
+        if self.resize:
+            if self.value_range is None:
+                self.value_range = [value.min(), value.max()]
+            value -= self.value_range[0]
+            value /= self.value_range[1] - self.value_range[0]
+            numpy.clip(value, 0, 1, out=value)
+        return value
+
+    def get_tile(self, tile_y, tile_x):
+        with self.lock:
+            if (tile_y, tile_x) in self.tiles:
+                self.tiles.move_to_end((tile_y, tile_x))
+                return self.tiles[(tile_y, tile_x)]
+        tile = self.generate(tile_y * self.tile_size, tile_x * self.tile_size, self.tile_size, self.tile_size)
+        tile.flags.writeable = False
+        with self.lock:
+            self.tiles[(tile_y, tile_x)] = tile
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        return tile
+
+    # any rectangle of the plane, negative positions included, assembled from cached tiles
+    def sample(self, region_y, region_x, height, width):
+        if self.resize and (self.value_range is None):
+            self.value_range = self.estimate_range(256, 256)
+        size = self.tile_size
+        value = numpy.empty((height, width), dtype=numpy.float32)
+        for tile_y in range(region_y // size, -(-(region_y + height) // size)):
+            for tile_x in range(region_x // size, -(-(region_x + width) // size)):
+                tile = self.get_tile(tile_y, tile_x)
+                y_start = max(region_y, tile_y * size)
+                y_end = min(region_y + height, (tile_y + 1) * size)
+                x_start = max(region_x, tile_x * size)
+                x_end = min(region_x + width, (tile_x + 1) * size)
+                value[y_start - region_y:y_end - region_y, x_start - region_x:x_end - region_x] = \
+                    tile[y_start - tile_y * size:y_end - tile_y * size, x_start - tile_x * size:x_end - tile_x * size]
+        return value
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["tiles"] = OrderedDict()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
 class Noise_Layer:
-    def __init__(self, local_map, obj) -> None:
+    def __init__(self, local_map, obj, seed=None) -> None:
         self.local_map = local_map
         self.width = local_map.get_width()
         self.height = local_map.get_height()
 
         self.id = obj["id"]
-        self.layers = obj["layers"]
-        self.power = obj["power"]
         self.resize = obj["resize"]
-
-        self.update()
-
+        # an unseeded layer still keeps one seed for its lifetime, so sample stays consistent
+        self.seed = seed
+        if seed is None:
+            self.seed = random.randint(0, 2147483647)
+        self.plane = Noise_Plane(obj, self.seed)
+        self.planes = {}
+
+        # without the whole map at hand the resize range comes from a fixed window at the origin,
+        # so startup does not grow with the map and every chunk size gives the same values
+        if self.resize and (self.plane.value_range is None) and (local_map.get_chunk_size() is not None):
+            self.plane.value_range = self.plane.estimate_range(256, 256)
+
+        local_map.register_layer(self.id, numpy.float32)
+        # an unseeded layer can not be reproduced, so it is never looked up in the cache
+        key = None
+        if seed is not None:
+            key = local_map.make_layer_key("Noise_Layer", obj, obj["Require"], seed, __file__)
+        local_map.set_attribute_generator(self.id, self.generate, key)
+
+        # a layer loaded from the cache never ran generate, its resize range is cached next to it
+        # so that sample beyond the map scales the same as the map itself
+        layer_cache = local_map.get_layer_cache()
+        if self.resize and (key is not None) and (layer_cache is not None):
+            range_key = companion_key(key, "value_range")
+            if self.plane.value_range is None:
+                value_range = layer_cache.load(range_key)
+                if value_range is not None:
+                    self.plane.value_range = [value_range[0], value_range[1]]
+            else:
+                layer_cache.store(range_key, numpy.array(self.plane.value_range, dtype=numpy.float32))
+
+    def generate(self, y, x, height, width):
+        return self.plane.generate(y, x, height, width)
+
+    # the layer's noise for any rectangle, also beyond the map
+    def sample(self, region_y, region_x, height, width):
+        return self.plane.sample(region_y, region_x, height, width)
 
     def update(self, **kwargs) -> None:
-        if not (("return_directly" in list(kwargs.keys())) and kwargs["return_directly"] is True):
-            noise_gen = []
-            total_weight = 0
-            for this_layer in range(len(self.layers)):
-                noise_gen.append(tcod.noise.Noise(dimensions=2, seed=random.randint(0, 2147483647)))
-                total_weight = total_weight + self.layers[str(this_layer)][0]
-
-            value = []
-            for y in range(self.height):
-                value.append([0] * self.width)
-
-            for this_layer in range(len(self.layers)):
-                value = value + self.layers[str(this_layer)][0] * \
-                        (noise_gen[this_layer][tcod.noise.grid(shape=(self.width, self.height),
-                                                               scale=self.layers[str(this_layer)][1])] + 1.0) * 0.5
-            value = numpy.array(value)
-
-            value = value / total_weight
-            value = numpy.power(value, self.power)
-            if self.resize is True:
-                value_decrease = value - value.min()
-                value = value_decrease / value_decrease.max()
-        else:
-            noise_gen = []
-            total_weight = 0
-            for this_layer in range(len(kwargs["parameters"][1])):
-                noise_gen.append(tcod.noise.Noise(dimensions=2, seed=random.randint(0, 2147483647)))
-                total_weight = total_weight + kwargs["parameters"][1][str(this_layer)][0]
-
-            value = []
-            for y in range(kwargs["height"]):
-                value.append([0] * kwargs["width"])
-
-            for this_layer in range(len(kwargs["parameters"][1])):
-                value = value + kwargs["parameters"][1][str(this_layer)][0] * \
-                        (noise_gen[this_layer][tcod.noise.grid(shape=(kwargs["width"], kwargs["height"]),
-                                                               scale=kwargs["parameters"][1][str(this_layer)][1])] + 1.0) * 0.5
-            value = numpy.array(value)
-
-            value = value / total_weight
-            value = numpy.power(value, kwargs["parameters"][2])
-            if kwargs["parameters"][2] is True:
-                value_decrease = value - value.min()
-                value = value_decrease / value_decrease.max()
-
-        if ("return_directly" in list(kwargs.keys())) and kwargs["return_directly"] is True:
-            return value
-        else:
-            self.local_map.set_attribute(self.id, value)
         return
 
-    def run_time_generate(self, height, width, obj):
-        return self.update(return_directly=True, height=height, width=width, parameters=[obj["id"], obj["layers"], obj["power"], obj["resize"]])
+    # noise of another configuration, seeded from this layer's seed and the configuration
+    def run_time_generate(self, height, width, obj, region_y=0, region_x=0):
+        key = json.dumps(obj, sort_keys=True)
+        if key not in self.planes:
+            self.planes[key] = Noise_Plane(obj, (self.seed + zlib.crc32(key.encode())) % 2147483648)
+        return self.planes[key].sample(region_y, region_x, height, width)
 
     def print(self, **kwargs):
         return
@@ -1,20 +1,23 @@
 import json
+import numpy
 from yapsy.IPlugin import IPlugin
 
 
 class Real_Time_Temperature_Plugin(IPlugin):
     def initialize(self, **kwargs):
         obj = kwargs["obj"]
-        this_mod = Real_Time_Temperature(obj)
+        local_map = kwargs["map"]
+        this_mod = Real_Time_Temperature(obj, local_map)
         return this_mod
 
 
 class Real_Time_Temperature:
-    def __init__(self, obj) -> None:
+    def __init__(self, obj, local_map) -> None:
         self.id = obj["id"]
         self.summer_inc = obj["summer_inc"]
         self.winter_dec = obj["winter_dec"]
         self.sunlight_multi = obj["sunlight_multi"]
+        local_map.register_layer("real_time_temperature", numpy.float32)
 
     def update(self, **kwargs) -> None:
         temperature = kwargs["map"].get_attribute("temperature")
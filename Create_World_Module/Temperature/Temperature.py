@@ -1,5 +1,13 @@
 from yapsy.IPlugin import IPlugin
 import json
+import numpy
+
+
+# how temperature blends across a pole or equator band, for a weight running from 0 to 1
+latitude_curves = {
+    "linear": lambda weight: weight,
+    "cosine": lambda weight: (1 - numpy.cos(numpy.pi * weight)) / 2
+}
 
 
 class Temperature_Plugin(IPlugin):
@@ -13,31 +21,56 @@ class Temperature_Plugin(IPlugin):
 class Temperature:
     def __init__(self, obj, local_map) -> None:
         self.id = obj["id"]
-        ocean_level_temp = obj["ocean_level_temp"]
-        temp_decline_per_1000 = obj["temp_decline_per_1000"]
-        pole_equator = obj["pole_equator"]
-        pole_percentage = obj["pole_percentage"]
-        equator_percentage = obj["equator_percentage"]
-
-        height = local_map.get_height()
-        elevation = local_map.get_attribute("elevation")
-        temperature = ocean_level_temp - elevation * temp_decline_per_1000 / 1000
-
-        if pole_equator:
-            for y in range(height):
-                if y <= height * pole_percentage / 2:
-                    temperature[y] = 2 * y * (temperature[y] + temp_decline_per_1000) / \
-                                     (height * pole_percentage) - temp_decline_per_1000
-                elif (y >= (0.5 - equator_percentage / 2) * height) and (y <= (0.5 + equator_percentage / 2) * height):
-                    temperature[y] = (1 - (2 * abs(0.5 * height - y)) / (height * equator_percentage)) * \
-                                     (ocean_level_temp + temp_decline_per_1000 - temperature[y]) + temperature[y]
-                elif y >= (height - height * pole_percentage / 2):
-                    temperature[y] = (temperature[y] + temp_decline_per_1000) * 2 * (height - y) / \
-                                     (pole_percentage * height) - temp_decline_per_1000
-
-        local_map.set_attribute(self.id, temperature)
+        self.ocean_level_temp = obj["ocean_level_temp"]
+        self.temp_decline_per_1000 = obj["temp_decline_per_1000"]
+        self.pole_equator = obj["pole_equator"]
+        self.pole_percentage = obj["pole_percentage"]
+        self.equator_percentage = obj["equator_percentage"]
+        self.latitude_curve = obj["latitude_curve"]
+        if self.latitude_curve not in latitude_curves:
+            raise ValueError("unknown latitude curve " + str(self.latitude_curve))
+
+        self.local_map = local_map
+        local_map.register_layer(self.id, numpy.float32)
+        local_map.set_attribute_generator(self.id, self.generate,
+                                          local_map.make_layer_key("Temperature", obj, obj["Require"], None, __file__))
         return
 
+    # per row factor and offset of the banding, temperature = factor * temperature + offset
+    def latitude_profile(self, y, height):
+        ocean_level_temp = self.ocean_level_temp
+        temp_decline_per_1000 = self.temp_decline_per_1000
+        map_height = self.local_map.get_height()
+        this_y = numpy.arange(y, y + height, dtype=numpy.float64)
+
+        curve = latitude_curves[self.latitude_curve]
+        north = this_y <= map_height * self.pole_percentage / 2
+        equator = (this_y >= (0.5 - self.equator_percentage / 2) * map_height) & \
+                  (this_y <= (0.5 + self.equator_percentage / 2) * map_height)
+        south = this_y >= (map_height - map_height * self.pole_percentage / 2)
+        # weights run from 0 at a pole to 1 at the edge of its band, and from 0 at that edge to 1 at the equator
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            north_weight = curve(numpy.clip(2 * this_y / (map_height * self.pole_percentage), 0, 1))
+            south_weight = curve(numpy.clip(2 * (map_height - this_y) / (map_height * self.pole_percentage), 0, 1))
+            equator_weight = curve(numpy.clip(1 - (2 * numpy.abs(0.5 * map_height - this_y)) /
+                                              (map_height * self.equator_percentage), 0, 1))
+
+        factor = numpy.select([north, equator, south], [north_weight, 1 - equator_weight, south_weight], 1)
+        offset = numpy.select([north, equator, south],
+                              [(north_weight - 1) * temp_decline_per_1000,
+                               equator_weight * (ocean_level_temp + temp_decline_per_1000),
+                               (south_weight - 1) * temp_decline_per_1000], 0)
+        return factor, offset
+
+    def generate(self, y, x, height, width):
+        elevation = numpy.asarray(self.local_map.get_region("elevation", y, x, height, width))
+        temperature = self.ocean_level_temp - elevation * self.temp_decline_per_1000 / 1000
+
+        if self.pole_equator:
+            factor, offset = self.latitude_profile(y, height)
+            temperature = factor[:, None] * temperature + offset[:, None]
+        return temperature
+
     def update(self, **kwargs) -> None:
         return
 
@@ -1,39 +1,140 @@
 from yapsy.IPlugin import IPlugin
+import random
+import warnings
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import numpy as np
+import tcod.console
+import Main_Menu.Create_World_State as mapclass
 
 
 class Town_Map_Plugin(IPlugin):
     def initialize(self, **kwargs):
         obj = kwargs["obj"]
-        this_mod = Town_Map(obj)
+        this_mod = Town_Map(obj, kwargs["seed"])
         return this_mod
 
 
+# a settlement's town before anyone entered it, open() builds or recalls the town map,
+# the families of the town are taken from the simulation mod the first time it has simulated
+@dataclass
+class Town_Stub:
+    settlement_id: int
+    seed: int
+    town_map: "Town_Map" = field(repr=False, compare=False)
+    noise_mod: object = field(repr=False, compare=False)
+    simulation_id: str = None
+    families: list = None
+
+    def open(self, mods=None, **kwargs) -> mapclass.MapData:
+        if (self.families is None) and (mods is not None) and (self.simulation_id in mods.keys()) and \
+                mods[self.simulation_id].get_simulated():
+            household_index = self.town_map.index_households(mods[self.simulation_id].get_families())
+            self.families = list(household_index.get(self.settlement_id, []))
+        return self.town_map.open_town(self)
+
+
 class Town_Map:
-    def __init__(self, obj) -> None:
+    def __init__(self, obj, seed=None) -> None:
         self.id = obj["id"]
         self.height = obj["height"]
         self.width = obj["width"]
         self.obj = obj
         self.threshold = obj["threshold"]
+        self.rand = random.Random(seed)
+
+        # ground and building tiles of the town screen
+        self.tiles = np.zeros(2, dtype=tcod.console.rgb_graphic)
+        self.tiles[0] = (ord(obj["ground_char"]), obj["ground_fg"], obj["ground_bg"])
+        self.tiles[1] = (ord(obj["building_char"]), obj["building_fg"], obj["building_bg"])
+
+        # recently entered towns are kept whole, every visited town keeps its packed plan
+        self.resident_towns = obj["resident_towns"]
+        self.towns = OrderedDict()
+        self.visited = {}
         return
 
     def update(self, **kwargs) -> None:
         return
 
-    def generate_town_map(self, households, settlement_id, noise_mod):
-        count = 0
-        families_here = []
+    # settlement id -> family ids, in one pass over the households
+    @staticmethod
+    def index_households(households):
+        index = {}
         for family_id in households.keys():
-            if households[family_id][0] == settlement_id:
-                families_here.append(family_id)
-                count += 1
+            index.setdefault(households[family_id][0], []).append(family_id)
+        return index
+
+    def get_town_stub(self, settlement_id, noise_mod, simulation_id=None):
+        return Town_Stub(settlement_id, self.rand.randint(0, 2147483647), self, noise_mod, simulation_id)
 
-        keys = ["id", "layers", "power", "resize"]
+    # a town whose families are not known yet is built without homes and neither kept nor remembered,
+    # so the next entry builds it again
+    def open_town(self, stub):
+        if stub.settlement_id in self.towns:
+            self.towns.move_to_end(stub.settlement_id)
+            return self.towns[stub.settlement_id]
+        families = stub.families if stub.families is not None else []
+        if stub.settlement_id in self.visited:
+            plan = np.unpackbits(self.visited[stub.settlement_id])[0:self.height * self.width]
+            plan = plan.reshape(self.height, self.width).astype(bool)
+        else:
+            plan = self.generate_plan(stub.settlement_id, stub.noise_mod, len(families))
+        town = self.generate_town_map(plan, families, stub.seed)
+        if stub.families is not None:
+            self.visited[stub.settlement_id] = np.packbits(plan)
+            self.towns[stub.settlement_id] = town
+            while len(self.towns) > self.resident_towns:
+                self.towns.popitem(last=False)
+        return town
+
+    # buildings where the town noise is above threshold, the threshold comes down until every family
+    # has a building cell, one cell is always left for the street
+    def generate_plan(self, settlement_id, noise_mod, households=0):
+        keys = ["id", "layers", "power", "resize", "implementation", "fbm"]
         selected = {k: self.obj[k] for k in keys if k in self.obj}
-        this_plan = noise_mod.run_time_generate(self.height, self.width, selected)
-        test = this_plan > self.threshold
-        test = 2
-        return
+        # every settlement has its own rows of the town plan plane, so the same town always looks the same
+        this_plan = noise_mod.run_time_generate(self.height, self.width, selected, settlement_id * self.height, 0)
+        plan = this_plan > self.threshold
+        households = min(households, self.height * self.width - 1)
+        if plan.sum() < households:
+            ordered = np.argsort(this_plan, axis=None, kind="stable")
+            plan = np.zeros(self.height * self.width, dtype=bool)
+            plan[ordered[len(ordered) - households:]] = True
+            plan = plan.reshape(self.height, self.width)
+        return plan
+
+    def generate_town_map(self, plan, families, seed):
+        rand = random.Random(seed)
+        walkable = (~plan).astype(np.uint8)
+        street_y, street_x = np.nonzero(walkable)
+        if len(street_y) == 0:
+            raise ValueError("town plan has no walkable cell, lower threshold of " + self.id)
+        # the gate is the street cell nearest to the town center
+        gate = np.argmin((street_y - self.height // 2) ** 2 + (street_x - self.width // 2) ** 2)
+        pass_enter = [[int(street_y[gate]), int(street_x[gate])]]
+
+        # every family lives in one building cell, marked with its index in families, -1 where nobody lives
+        households = np.full((self.height, self.width), -1, dtype=np.int32)
+        building_y, building_x = np.nonzero(plan)
+        if len(families) > len(building_y):
+            warnings.warn(self.id + ": " + str(len(families) - len(building_y)) + " of " + str(len(families)) +
+                          " families have no home, the town has only " + str(len(building_y)) + " building cells")
+        homes = np.array(rand.sample(range(len(building_y)), min(len(families), len(building_y))), dtype=np.intp)
+        households[building_y[homes], building_x[homes]] = np.arange(len(homes), dtype=np.int32)
+
+        town = mapclass.MapData(self.height, self.width, enter_point=list(pass_enter), walkable=walkable,
+                                exit_point=list(pass_enter))
+        town.register_layer("households", np.int32)
+        town.set_attribute("households", households)
+        town.set_default_screen(self.tiles[plan.astype(np.uint8)])
+        return town
+
+    # towns in memory are rebuilt from their plans after loading
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["towns"] = OrderedDict()
+        return state
 
     def print(self, **kwargs): # None or list[page, content]
         return
@@ -0,0 +1,66 @@
+import functools
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+# hash of a generator's source file, editing the generator retires the layers it cached
+@functools.lru_cache(maxsize=None)
+def source_version(path):
+    if path is None:
+        return None
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def layer_key(module, obj, upstream, seed, height, width, version=None):
+    # content address of a generated layer, None when it cannot be reproduced
+    if None in upstream:
+        return None
+    payload = json.dumps([module, version, obj, upstream, seed, height, width], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# key of a small value stored alongside a cached layer
+def companion_key(key, name):
+    if key is None:
+        return None
+    return hashlib.sha256((key + ":" + name).encode()).hexdigest()
+
+
+def region_key(key, y, x, height, width):
+    if key is None:
+        return None
+    return hashlib.sha256((key + ":" + ",".join(str(i) for i in (y, x, height, width))).encode()).hexdigest()
+
+
+class LayerCache:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def get_directory(self) -> str:
+        return self.directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[0:2], key + ".npy")
+
+    def load(self, key: str):
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.load(path)
+
+    def store(self, key: str, layer: np.ndarray) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write next to the target and swap it in, a concurrent reader never sees half a file
+        temp_path = path + "." + str(os.getpid()) + "." + str(id(layer)) + ".tmp"
+        with open(temp_path, 'wb') as file:
+            np.save(file, layer)
+        os.replace(temp_path, path)
@@ -1,5 +1,7 @@
 from yapsy.PluginManager import PluginManager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import glob
+import hashlib
 import json
 import os.path
 from Library import UI
@@ -19,12 +21,146 @@ def validate_modules(root):
             file.close()
 
 
-def mods_set_up(plugin_place, template_place, local_map, peoples):
+def build_mod_graph(mod_ordered, config_ordered):
+    # mod id -> [config, required mod ids that are loaded as well]
+    graph = {}
+    for i in range(len(mod_ordered)):
+        with open(config_ordered[i], 'r') as file:
+            data = file.read()
+        file.close()
+        obj = json.loads(data)
+        graph[mod_ordered[i]] = [obj, [j for j in obj["Require"] if j in mod_ordered]]
+    return graph
+
+
+def mod_seed(seed, mod_id):
+    # every mod draws from its own seed, so the result does not depend on which mod runs first
+    if seed is None:
+        return None
+    return int.from_bytes(hashlib.sha256((str(seed) + ":" + mod_id).encode()).digest()[0:4], "little")
+
+
+def initialize_mods(mod_manager, mod_ordered, config_ordered, module_ordered, local_map, peoples, max_workers=1,
+                    seed=None):
+    # mods whose requirements are met are initialized side by side when max_workers allows it,
+    # one worker by default since not every plugin or map is safe to share between threads,
+    # the result keeps mod_ordered
+    plugins = {}
+    for pluginInfo in mod_manager.getAllPlugins():
+        plugins[pluginInfo.name] = pluginInfo.plugin_object
+    modules = dict(zip(mod_ordered, module_ordered))
+    graph = build_mod_graph(mod_ordered, config_ordered)
+
+    mods_load = {}
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while len(done) < len(graph):
+            for mod_id in graph:
+                if (mod_id in done) or (mod_id in running.values()):
+                    continue
+                if all(j in done for j in graph[mod_id][1]):
+                    if modules[mod_id] in plugins:
+                        future = pool.submit(plugins[modules[mod_id]].initialize, map=local_map, peoples=peoples,
+                                             mods=mods_load, obj=graph[mod_id][0], seed=mod_seed(seed, mod_id))
+                        running[future] = mod_id
+                    else:
+                        done.add(mod_id)
+            if len(running) == 0:
+                if len(done) < len(graph):
+                    raise ValueError("circular Require among " + str([j for j in graph if j not in done]))
+                break
+            finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in finished:
+                mod_id = running.pop(future)
+                mods_load[mod_id] = future.result()
+                done.add(mod_id)
+
+    ordered = [(mod_id, mods_load[mod_id]) for mod_id in graph if mod_id in mods_load]
+    mods_load.clear()
+    mods_load.update(ordered)
+    return mods_load
+
+
+def load_mod(mod_config, id_table, mod_manager, mods_tobe_added, mod_ordered, config_ordered,
+             module_ordered):
+    with open(mod_config, 'r') as file:
+        data = file.read()
+    file.close()
+    obj = json.loads(data)
+    require = obj["Require"]
+    module = obj["Module"]
+    this_id = obj["id"]
+
+    # check require
+    if len(require) > 0:
+        for i in require:
+            satisfied = False
+            for j in mod_ordered:
+                if i == j:
+                    satisfied = True
+            if not satisfied:
+                load_mod(id_table[i], id_table, mod_manager, mods_tobe_added, mod_ordered,
+                         config_ordered,
+                         module_ordered)
+
+    mod_ordered.append(this_id)
+    config_ordered.append(mod_config)
+    module_ordered.append(module)
+    remove = False
+    remove_index = "QwQ"
+    for i in mods_tobe_added:
+        if mod_config == mods_tobe_added[i]:
+            remove = True
+            remove_index = i
+            break
+    if remove:
+        mods_tobe_added.pop(remove_index)
+
+
+def load_template(template_dir, mod_ordered, config_ordered, module_ordered):
+    # every mod of the template goes in after the mods it requires
+    mods = glob.glob(template_dir + "/*.json", recursive=True)
+    id_table = {}
+    mods_tobe_added = {}
+    for i in mods:
+        with open(i, 'r') as file:
+            data = file.read()
+        file.close()
+        obj = json.loads(data)
+        id_table[obj["id"]] = i
+        mods_tobe_added[len(mods_tobe_added)] = i
+
+    while len(mods_tobe_added) > 0:
+        mod_config = mods_tobe_added.popitem()[1]
+        load_mod(mod_config, id_table, None, mods_tobe_added, mod_ordered, config_ordered,
+                 module_ordered)
+
+
+def collect_mods(plugin_place):
     for directory in plugin_place:
         if directory[-1] == "/":
             validate_modules(directory[0:(len(directory)-1)])
         else:
             validate_modules(directory[0:len(directory)])
+    mod_manager = PluginManager()
+    mod_manager.setPluginPlaces(plugin_place)
+    mod_manager.collectPlugins()
+    return mod_manager
+
+
+def mods_set_up_headless(plugin_place, template_dir, local_map, peoples, max_workers=1, seed=None):
+    # same as mods_set_up with the whole template loaded, without any menu
+    mod_manager = collect_mods(plugin_place)
+    mod_ordered = []
+    config_ordered = []
+    module_ordered = []
+    load_template(template_dir, mod_ordered, config_ordered, module_ordered)
+    return initialize_mods(mod_manager, mod_ordered, config_ordered, module_ordered, local_map, peoples,
+                           max_workers=max_workers, seed=seed)
+
+
+def mods_set_up(plugin_place, template_place, local_map, peoples, max_workers=1, seed=None):
 
     mod_configuration_menu = {
         0: "Load Template",
@@ -35,41 +171,6 @@ def mods_set_up(plugin_place, template_place, local_map, peoples):
         5: "Save And Finish"
     }
 
-    def load_mod(mod_config, id_table, mod_manager, mods_tobe_added, mod_ordered, config_ordered,
-                 module_ordered):
-        with open(mod_config, 'r') as file:
-            data = file.read()
-        file.close()
-        obj = json.loads(data)
-        require = obj["Require"]
-        module = obj["Module"]
-        this_id = obj["id"]
-
-        # check require
-        if len(require) > 0:
-            for i in require:
-                satisfied = False
-                for j in mod_ordered:
-                    if i == j:
-                        satisfied = True
-                if not satisfied:
-                    load_mod(id_table[i], id_table, mod_manager, mods_tobe_added, mod_ordered,
-                             config_ordered,
-                             module_ordered)
-
-        mod_ordered.append(this_id)
-        config_ordered.append(mod_config)
-        module_ordered.append(module)
-        remove = False
-        remove_index = "QwQ"
-        for i in mods_tobe_added:
-            if mod_config == mods_tobe_added[i]:
-                remove = True
-                remove_index = i
-                break
-        if remove:
-            mods_tobe_added.pop(remove_index)
-
     def modconfig_function_map(choice, mod_manager, mod_ordered, config_ordered,
                                module_ordered):
         finish = False
@@ -94,31 +195,14 @@ def mods_set_up(plugin_place, template_place, local_map, peoples):
                     return finish
                 UI.CONSOLE.clear()
 
-                mods = glob.glob(template_place + choice[-1][0] + "/*.json", recursive=True)
-                id_table = {}
-                mods_tobe_added = {}
-                for i in mods:
-                    with open(i, 'r') as file:
-                        data = file.read()
-                    file.close()
-                    obj = json.loads(data)
-                    id_table[obj["id"]] = i
-                    mods_tobe_added[len(mods_tobe_added)] = i
-
-                while len(mods_tobe_added) > 0:
-                    mod_config = mods_tobe_added.popitem()[1]
-                    load_mod(mod_config, id_table, mod_manager, mods_tobe_added, mod_ordered, config_ordered,
-                             module_ordered)
+                load_template(template_place + choice[-1][0], mod_ordered, config_ordered, module_ordered)
                 return finish
         elif choice == 'Save And Finish':
             finish = True
             return finish
 
     # start mod manager UI
-    mods_load = {}
-    mod_manager = PluginManager()
-    mod_manager.setPluginPlaces(plugin_place)
-    mod_manager.collectPlugins()
+    mod_manager = collect_mods(plugin_place)
 
     mod_ordered = []
     config_ordered = []
@@ -140,15 +224,5 @@ def mods_set_up(plugin_place, template_place, local_map, peoples):
                                         module_ordered)
         if finish:
             break
-    for i in range(len(mod_ordered)):
-        for pluginInfo in mod_manager.getAllPlugins():
-            if pluginInfo.name == module_ordered[i]:
-                with open(config_ordered[i], 'r') as file:
-                    data = file.read()
-                file.close()
-                obj = json.loads(data)
-                this_mod = pluginInfo.plugin_object.initialize(map=local_map, peoples=peoples, mods=mods_load,
-                                                               obj=obj)
-                mods_load[mod_ordered[i]] = this_mod
-
-    return mods_load
+    return initialize_mods(mod_manager, mod_ordered, config_ordered, module_ordered, local_map, peoples,
+                           max_workers=max_workers, seed=seed)
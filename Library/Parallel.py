@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def row_bands(height, bands):
+    edges = np.linspace(0, height, bands + 1).astype(int)
+    return [(edges[i], edges[i + 1]) for i in range(bands) if edges[i] < edges[i + 1]]
+
+
+# one uniform draw per cell, looked up in the cumulative table of its (state, target) pair
+def sample_categorical(state, targets, cumulative, rng):
+    draw = rng.random(state.shape)
+    new_state = np.zeros(state.shape, dtype=state.dtype)
+    for x in range(cumulative.shape[2] - 1):
+        new_state += draw >= cumulative[:, :, x][state, targets]
+    return new_state
+
+
+def _sample_band(state_name, targets_name, shape, state_dtype, targets_dtype, cumulative, start, stop, seed_sequence):
+    # runs in a worker, the band's rows are read and written in place
+    state_block = shared_memory.SharedMemory(name=state_name)
+    targets_block = shared_memory.SharedMemory(name=targets_name)
+    try:
+        state = np.ndarray(shape, dtype=state_dtype, buffer=state_block.buf)
+        targets = np.ndarray(shape, dtype=targets_dtype, buffer=targets_block.buf)
+        state[start:stop] = sample_categorical(state[start:stop], targets[start:stop], cumulative,
+                                               np.random.default_rng(seed_sequence))
+        del state, targets
+    finally:
+        state_block.close()
+        targets_block.close()
+
+
+class BandPool:
+    # process pool that samples row bands of a map in shared memory, every band with its own generator
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self.pool = None
+
+    def sample_categorical(self, state, targets, cumulative, seed_sequence):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        state = np.ascontiguousarray(state)
+        targets = np.ascontiguousarray(targets)
+        bands = row_bands(state.shape[0], self.workers)
+        seed_sequences = seed_sequence.spawn(len(bands))
+
+        state_block = shared_memory.SharedMemory(create=True, size=max(state.nbytes, 1))
+        targets_block = shared_memory.SharedMemory(create=True, size=max(targets.nbytes, 1))
+        try:
+            shared_state = np.ndarray(state.shape, dtype=state.dtype, buffer=state_block.buf)
+            shared_targets = np.ndarray(targets.shape, dtype=targets.dtype, buffer=targets_block.buf)
+            shared_state[...] = state
+            shared_targets[...] = targets
+            futures = [self.pool.submit(_sample_band, state_block.name, targets_block.name, state.shape,
+                                        state.dtype, targets.dtype, cumulative, bands[i][0], bands[i][1],
+                                        seed_sequences[i])
+                       for i in range(len(bands))]
+            for future in futures:
+                future.result()
+            new_state = shared_state.copy()
+            del shared_state, shared_targets
+        finally:
+            state_block.close()
+            state_block.unlink()
+            targets_block.close()
+            targets_block.unlink()
+        return new_state
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    # worker processes do not survive a save, they start again on the next use
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pool"] = None
+        return state
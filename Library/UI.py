@@ -563,6 +563,20 @@ class tcod_window:
 
 
 
+class null_window(tcod_window):
+    # window without a console, plugins add frames and entities to it as usual but nothing is drawn
+    def __init__(self, *args):
+        if len(args) == 0:
+            args = (ntcod_tile(0, 0, HEIGHT, WIDTH),)
+        super().__init__(*args)
+
+    def display_all(self):
+        return
+
+    def display(self):
+        return "last_page"
+
+
 class tcod_frame:
     def __init__(self, start_y, start_x, y_span, x_span, draw_frame=False):
         self.start_print_y = start_y + 1
@@ -1394,6 +1408,10 @@ class color_layers:
 
         # ---------- 写回 α ----------
         if isinstance(p_alpha, np.ndarray):
+            if not p_alpha.flags.writeable:
+                # 只读视图（可能被多个回合共享），先复制一份
+                p_alpha = np.array(p_alpha)
+                self.color_layers[parent_key][5] = p_alpha
             p_alpha[rel_y:rel_y + y_span, rel_x:rel_x + x_span] = alpha_block
         else:  # list[list[int]]
             for dy in range(y_span):
@@ -1487,7 +1505,12 @@ class ntcod_tile(tcod_frame):
         self.overlap_entities = []
 
     def display(self):
-        if self.height >= self.final_y_span and self.width >= self.final_x_span:
+        if (self.height >= self.final_y_span and self.width >= self.final_x_span) and isinstance(self.screen, np.ndarray):
+            # screens in the console's own dtype are copied over directly
+            CONSOLE.rgb[self.final_start_y:self.final_start_y + self.final_y_span, self.final_start_x:self.final_start_x + self.final_x_span] = \
+                self.screen[self.tileprintstart_y:self.tileprintstart_y + self.final_y_span,
+                            self.tileprintstart_x:self.tileprintstart_x + self.final_x_span]
+        elif self.height >= self.final_y_span and self.width >= self.final_x_span:
             newconsole = []
             for row in self.screen[self.tileprintstart_y:self.tileprintstart_y + self.final_y_span]:
                 newline = []
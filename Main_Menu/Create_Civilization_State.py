@@ -1,7 +1,9 @@
 import copy
+import random
 from Library import UI
 from Library import Module
 from Library import IO
+import numpy as np
 import pandas as pd
 import tcod
 
@@ -80,6 +82,21 @@ class Civilization:
         return self.mods
 
 
+# build a civilization from every mod of a template without any menu
+def generate_civilization(civilization_name: str, population: int,
+                          template_dir: str = "Create_Civilization_Template/Default", seed: int = None) -> Civilization:
+    peoples = PopulationData(population)
+    if seed is not None:
+        # these mods draw from the global random state, one at a time keeps the result reproducible
+        random.seed(seed)
+        np.random.seed(seed)
+        mods_load = Module.mods_set_up_headless(["Create_Civilization_Module/"], template_dir, None, peoples,
+                                                max_workers=1, seed=seed)
+    else:
+        mods_load = Module.mods_set_up_headless(["Create_Civilization_Module/"], template_dir, None, peoples)
+    return Civilization(civilization_name, peoples, mods_load)
+
+
 create_civilization_menu = {
     0: "Name Civilization To Create",
     1: "Set The Number of People",
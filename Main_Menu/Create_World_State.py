@@ -1,10 +1,14 @@
 import copy
+import random
+import os
+import threading
 
 import numpy as np
 import tcod
 from Library import UI
 from Library import Module
 from Library import IO
+from Library.Cache import LayerCache, layer_key, region_key, source_version
 from Library.UI import OTH, OTW, OFH, OFW, OFHS, OFWS
 
 
@@ -15,7 +19,11 @@ class MapData:
 
         self.default_screen = []
         self._layers = {}
+        self._layer_specs = {}
+        self._shared = set()
         self._submaps = {}
+        self._layer_cache = None
+        self._layer_keys = {}
 
         if enter_point is not None:
             self.enter_point = enter_point
@@ -24,7 +32,7 @@ class MapData:
         if walkable is not None:
             self.walkable = walkable
         else:
-            self.walkable = np.zeros((self._height, self._width)) + 1
+            self.walkable = np.ones((self._height, self._width), dtype=np.uint8)
         if exit_point is not None:
             self.exit_point = exit_point
         else:
@@ -46,40 +54,406 @@ class MapData:
         return self._width
 
     def get_layer_names(self) -> list:
-        return copy.deepcopy(list(self._layers.keys()))
-
-    def get_attribute(self, attribute: str) -> list:
-        return copy.deepcopy(self._layers[attribute])
+        return list(self._layers.keys())
+
+    def get_chunk_size(self):
+        return None
+
+    def set_layer_cache(self, layer_cache: LayerCache) -> None:
+        self._layer_cache = layer_cache
+
+    def get_layer_cache(self):
+        return self._layer_cache
+
+    def get_layer_key(self, attribute: str):
+        return self._layer_keys.get(attribute)
+
+    # key of a layer generated by module with config obj from the layers it requires,
+    # source is the generator's file so that a changed generator does not reuse old layers
+    def make_layer_key(self, module: str, obj: dict, require: list, seed, source: str = None):
+        upstream = [self.get_layer_key(i) for i in require if i in self.get_layer_names()]
+        return layer_key(module, obj, upstream, seed, self._height, self._width, source_version(source))
+
+    def register_layer(self, attribute: str, dtype, shape: tuple = None) -> None:
+        if shape is None:
+            shape = (self._height, self._width)
+        self._layer_specs[attribute] = [np.dtype(dtype), tuple(shape)]
+        if attribute in self._layers:
+            self.set_attribute(attribute, self._layers[attribute])
+
+    def get_layer_spec(self, attribute: str):
+        if attribute in self._layer_specs:
+            return list(self._layer_specs[attribute])
+
+    def get_memory_report(self) -> dict:
+        report = {}
+        for attribute, layer in self._layers.items():
+            if isinstance(layer, np.ndarray):
+                report[attribute] = layer.nbytes
+        return report
+
+    def _validate_layer(self, attribute: str, new_data, region: tuple = None):
+        if attribute not in self._layer_specs:
+            return new_data
+        dtype, shape = self._layer_specs[attribute]
+        if region is not None:
+            shape = tuple(region) + shape[2:]
+        data = np.asarray(new_data)
+        if data.shape != shape:
+            raise ValueError(f"layer {attribute!r} is registered with shape {shape}, got {data.shape}")
+        if data.dtype == dtype:
+            return data
+        if np.issubdtype(dtype, np.integer):
+            # integer layers accept any integer data as long as the values fit
+            if not (np.issubdtype(data.dtype, np.integer) or data.dtype == np.bool_):
+                raise TypeError(f"layer {attribute!r} is registered as {dtype}, cannot store {data.dtype}")
+            if data.size > 0:
+                limits = np.iinfo(dtype)
+                if data.min() < limits.min or data.max() > limits.max:
+                    raise ValueError(f"layer {attribute!r} holds values outside the range of {dtype}")
+        elif not np.can_cast(data.dtype, dtype, casting="same_kind"):
+            raise TypeError(f"layer {attribute!r} is registered as {dtype}, cannot store {data.dtype}")
+        return data.astype(dtype)
+
+    # layers are handed out as read-only views, writers take a copy and commit it back
+    def get_attribute(self, attribute: str) -> np.ndarray:
+        layer = self._layers[attribute]
+        if not isinstance(layer, np.ndarray):
+            return copy.deepcopy(layer)
+        self._shared.add(attribute)
+        view = layer.view()
+        view.flags.writeable = False
+        return view
 
     def get_attribute_at(self, attribute: str, at_y: int, at_x: int):
-        return copy.deepcopy(self._layers[attribute][at_y][at_x])
+        layer = self._layers[attribute]
+        if not isinstance(layer, np.ndarray):
+            return copy.deepcopy(layer[at_y][at_x])
+        value = layer[at_y, at_x]
+        if isinstance(value, np.ndarray):
+            value = value.copy()
+        return value
+
+    def get_writable_attribute(self, attribute: str) -> np.ndarray:
+        return np.array(self._layers[attribute], copy=True)
+
+    def commit_attribute(self, attribute: str, new_data: np.ndarray) -> None:
+        if attribute in self._layers:
+            old_shape = np.shape(self._layers[attribute])
+            if np.shape(new_data) != old_shape:
+                raise ValueError(f"layer {attribute!r} has shape {old_shape}, got {np.shape(new_data)}")
+        self.set_attribute(attribute, new_data)
 
     def set_attribute(self, attribute: str, new_data: list) -> None:
-        self._layers[attribute] = new_data
+        self._layers[attribute] = self._validate_layer(attribute, new_data)
+        self._shared.discard(attribute)
+        self._layer_keys.pop(attribute, None)
+
+    # generation plugins hand in a function of (y, x, height, width) returning that region of the layer,
+    # a plain map evaluates it for the whole map right away
+    def set_attribute_generator(self, attribute: str, generator, key: str = None) -> None:
+        layer = None
+        if (key is not None) and (self._layer_cache is not None):
+            layer = self._layer_cache.load(key)
+        if layer is None:
+            self.set_attribute(attribute, generator(0, 0, self._height, self._width))
+            if (key is not None) and (self._layer_cache is not None):
+                self._layer_cache.store(key, self._layers[attribute])
+        else:
+            self.set_attribute(attribute, layer)
+        if key is not None:
+            self._layer_keys[attribute] = key
+
+    def get_region(self, attribute: str, y: int, x: int, height: int, width: int) -> np.ndarray:
+        return self.get_attribute(attribute)[y:y + height, x:x + width]
 
     def set_attribute_at(self, attribute: str, at_y: int, at_x: int, new_data) -> None:
-        self._layers[attribute][at_y][at_x] = new_data
+        layer = self._layers[attribute]
+        if attribute in self._shared:
+            # views of this layer are out there, detach them before writing
+            layer = layer.copy()
+            self._layers[attribute] = layer
+            self._shared.discard(attribute)
+        self._layer_keys.pop(attribute, None)
+        if isinstance(layer, np.ndarray):
+            layer[at_y, at_x] = new_data
+        else:
+            layer[at_y][at_x] = new_data
 
     def set_submap(self, y: int, x: int, subid: str, module: str, submap: 'MapData') -> None:
-        if not ((y, x) in list(self._submaps.keys())):
+        if not ((y, x) in self._submaps):
             self._submaps[(y, x)] = []
         self._submaps[(y, x)].append([subid, submap, module])
 
     def get_submap(self, y: int, x: int) -> list:
-        if (y, x) in list(self._submaps.keys()):
-            return copy.deepcopy(self._submaps[(y, x)])
+        if (y, x) in self._submaps:
+            return [list(entry) for entry in self._submaps[(y, x)]]
 
     def get_submap_keys(self) -> list:
         return list(self._submaps.keys())
 
+    # a submap is a MapData, or a stub whose open() builds one when it is entered,
+    # kwargs (the mods of the game) are handed on to open()
+    def open_submap(self, y: int, x: int, index: int, **kwargs) -> 'MapData':
+        submap = self._submaps[(y, x)][index][1]
+        if isinstance(submap, MapData):
+            return submap
+        return submap.open(**kwargs)
+
+    # the default screen is shared, callers must not modify it in place
     def get_default_screen(self) -> list:
-        return copy.deepcopy(self.default_screen)
+        return self.default_screen
 
     def set_default_screen(self, new_screen: list) -> None:
         self.default_screen = new_screen
 
+    def set_default_screen_generator(self, generator) -> None:
+        self.set_default_screen(generator(0, 0, self._height, self._width))
+
     def set_default_screen_to_tile(self, tileframe):
-        tileframe.set_defaultscreen(self.default_screen)
+        tileframe.set_defaultscreen(self.get_default_screen())
+
+
+# layers given by a generator are produced chunk by chunk the first time a chunk is touched,
+# reading a whole layer generates the rest of it
+class ChunkedMapData(MapData):
+    def __init__(self, height: int, width: int, chunk_size: int = 64, enter_point = None, walkable = None, exit_point = None) -> None:
+        super().__init__(height, width, enter_point=enter_point, walkable=walkable, exit_point=exit_point)
+        self._chunk_size = chunk_size
+        self._generators = {}
+        self._chunks = {}
+        self._screen_generator = None
+        # plugins may be initialized from several threads
+        self._lock = threading.RLock()
+
+    def get_chunk_size(self) -> int:
+        return self._chunk_size
+
+    def get_layer_names(self) -> list:
+        return list(self._layers.keys()) + list(self._generators.keys())
+
+    def get_generated_chunks(self, attribute: str) -> list:
+        if attribute in self._chunks:
+            return list(self._chunks[attribute].keys())
+        return []
+
+    def _get_chunk(self, attribute: str, chunk_y: int, chunk_x: int) -> np.ndarray:
+        with self._lock:
+            return self._generate_chunk(attribute, chunk_y, chunk_x)
+
+    def _generate_chunk(self, attribute: str, chunk_y: int, chunk_x: int) -> np.ndarray:
+        chunks = self._chunks[attribute]
+        if (chunk_y, chunk_x) not in chunks:
+            y = chunk_y * self._chunk_size
+            x = chunk_x * self._chunk_size
+            height = min(self._chunk_size, self._height - y)
+            width = min(self._chunk_size, self._width - x)
+            key = region_key(self._layer_keys.get(attribute), y, x, height, width)
+            chunk = None
+            if (key is not None) and (self._layer_cache is not None):
+                chunk = self._layer_cache.load(key)
+            if chunk is None:
+                chunk = np.asarray(self._validate_layer(attribute, self._generators[attribute](y, x, height, width),
+                                                        region=(height, width)))
+                if (key is not None) and (self._layer_cache is not None):
+                    self._layer_cache.store(key, chunk)
+            chunk.flags.writeable = False
+            chunks[(chunk_y, chunk_x)] = chunk
+        return chunks[(chunk_y, chunk_x)]
+
+    def _materialize(self, attribute: str) -> None:
+        with self._lock:
+            if attribute in self._generators:
+                full = np.array(self.get_region(attribute, 0, 0, self._height, self._width))
+                key = self._layer_keys.get(attribute)
+                del self._generators[attribute]
+                del self._chunks[attribute]
+                MapData.set_attribute(self, attribute, full)
+                if key is not None:
+                    self._layer_keys[attribute] = key
+
+    def get_region(self, attribute: str, y: int, x: int, height: int, width: int) -> np.ndarray:
+        with self._lock:
+            if attribute not in self._generators:
+                return super().get_region(attribute, y, x, height, width)
+            return self._assemble_region(attribute, y, x, height, width)
+
+    def _assemble_region(self, attribute: str, y: int, x: int, height: int, width: int) -> np.ndarray:
+        size = self._chunk_size
+        rows = []
+        for chunk_y in range(y // size, (y + height - 1) // size + 1):
+            row = [self._get_chunk(attribute, chunk_y, chunk_x)
+                   for chunk_x in range(x // size, (x + width - 1) // size + 1)]
+            rows.append(row[0] if len(row) == 1 else np.concatenate(row, axis=1))
+        block = rows[0] if len(rows) == 1 else np.concatenate(rows, axis=0)
+        region = block[y % size:y % size + height, x % size:x % size + width]
+        region.flags.writeable = False
+        return region
+
+    def get_attribute(self, attribute: str) -> np.ndarray:
+        self._materialize(attribute)
+        return super().get_attribute(attribute)
+
+    def get_attribute_at(self, attribute: str, at_y: int, at_x: int):
+        with self._lock:
+            if attribute not in self._generators:
+                return super().get_attribute_at(attribute, at_y, at_x)
+            chunk = self._generate_chunk(attribute, at_y // self._chunk_size, at_x // self._chunk_size)
+        value = chunk[at_y % self._chunk_size, at_x % self._chunk_size]
+        if isinstance(value, np.ndarray):
+            value = value.copy()
+        return value
+
+    def get_writable_attribute(self, attribute: str) -> np.ndarray:
+        self._materialize(attribute)
+        return super().get_writable_attribute(attribute)
+
+    def set_attribute(self, attribute: str, new_data: list) -> None:
+        with self._lock:
+            self._generators.pop(attribute, None)
+            self._chunks.pop(attribute, None)
+            super().set_attribute(attribute, new_data)
+
+    def set_attribute_at(self, attribute: str, at_y: int, at_x: int, new_data) -> None:
+        self._materialize(attribute)
+        super().set_attribute_at(attribute, at_y, at_x, new_data)
+
+    def set_attribute_generator(self, attribute: str, generator, key: str = None) -> None:
+        with self._lock:
+            self._layers.pop(attribute, None)
+            self._shared.discard(attribute)
+            self._generators[attribute] = generator
+            self._chunks[attribute] = {}
+            self._layer_keys.pop(attribute, None)
+            if key is not None:
+                self._layer_keys[attribute] = key
+
+    def get_memory_report(self) -> dict:
+        report = super().get_memory_report()
+        for attribute, chunks in self._chunks.items():
+            report[attribute] = sum(chunk.nbytes for chunk in chunks.values())
+        return report
+
+    def set_default_screen(self, new_screen: list) -> None:
+        self._screen_generator = None
+        super().set_default_screen(new_screen)
+
+    def set_default_screen_generator(self, generator) -> None:
+        self._screen_generator = generator
+        self.default_screen = []
+
+    def get_default_screen(self) -> list:
+        with self._lock:
+            if self._screen_generator is not None:
+                self.default_screen = self._screen_generator(0, 0, self._height, self._width)
+                self._screen_generator = None
+            return self.default_screen
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+
+# keeps every array layer in a .npy file under world_dir and maps it in on demand
+class MemmapMapData(MapData):
+    def __init__(self, height: int, width: int, world_dir: str, enter_point = None, walkable = None, exit_point = None) -> None:
+        super().__init__(height, width, enter_point=enter_point, walkable=walkable, exit_point=exit_point)
+        # layer files are recorded by absolute path, a saved world reopens them from any working directory
+        self._world_dir = os.path.abspath(world_dir)
+        self._files = {}
+        self._stale = []
+        self._generation = 0
+        # mods may be initialized side by side, a layer's file is swapped under this lock
+        self._lock = threading.RLock()
+        os.makedirs(self._world_dir, exist_ok=True)
+
+    def get_world_dir(self) -> str:
+        return self._world_dir
+
+    def _new_file(self, attribute: str, dtype, shape) -> np.memmap:
+        with self._lock:
+            self._generation += 1
+            path = os.path.join(self._world_dir, attribute + "." + str(self._generation) + ".npy")
+            layer = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+            self._drop_file(attribute)
+            self._files[attribute] = path
+        return layer
+
+    def _drop_file(self, attribute: str) -> None:
+        if attribute in self._files:
+            self._stale.append(self._files[attribute])
+            del self._files[attribute]
+        # files still mapped by a reader on this platform are removed on a later try
+        for path in list(self._stale):
+            try:
+                os.remove(path)
+                self._stale.remove(path)
+            except FileNotFoundError:
+                self._stale.remove(path)
+            except OSError:
+                pass
+
+    def set_attribute(self, attribute: str, new_data) -> None:
+        data = np.asarray(self._validate_layer(attribute, new_data))
+        with self._lock:
+            if data.dtype == object:
+                self._drop_file(attribute)
+                super().set_attribute(attribute, data)
+                return
+            # a layer no view was handed out of since its last write is written in place,
+            # otherwise the views keep the old file and the layer moves to a fresh one
+            layer = self._layers.get(attribute)
+            reuse = (attribute in self._files) and (attribute not in self._shared) and \
+                    (layer.shape == data.shape) and (layer.dtype == data.dtype)
+            if not reuse:
+                layer = self._new_file(attribute, data.dtype, data.shape)
+            layer[...] = data
+            layer.flush()
+            self._layers[attribute] = layer
+            self._shared.discard(attribute)
+            self._layer_keys.pop(attribute, None)
+
+    def set_attribute_at(self, attribute: str, at_y: int, at_x: int, new_data) -> None:
+        with self._lock:
+            if attribute not in self._files:
+                super().set_attribute_at(attribute, at_y, at_x, new_data)
+                return
+            layer = self._layers[attribute]
+            if attribute in self._shared:
+                # copy on write into a fresh file, row block by row block
+                old = layer
+                layer = self._new_file(attribute, old.dtype, old.shape)
+                for y in range(0, old.shape[0], 256):
+                    layer[y:y + 256] = old[y:y + 256]
+                self._layers[attribute] = layer
+                self._shared.discard(attribute)
+            self._layer_keys.pop(attribute, None)
+            layer[at_y, at_x] = new_data
+
+    def flush(self) -> None:
+        with self._lock:
+            for attribute in self._files:
+                self._layers[attribute].flush()
+
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        state["_layers"] = {k: v for k, v in self._layers.items() if k not in self._files}
+        state["_shared"] = set()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        for attribute, path in self._files.items():
+            self._layers[attribute] = np.load(path, mmap_mode="r+")
+
 
 class World:
     def __init__(self, name: str, local_map: MapData, mods: dict) -> None:
@@ -97,10 +471,36 @@ class World:
         return self.mods
 
 
+def new_map(height: int, width: int, layer_dir: str = "", chunk_size: int = 0, cache_dir: str = "") -> MapData:
+    if chunk_size > 0:
+        local_map = ChunkedMapData(height=height, width=width, chunk_size=chunk_size)
+    elif layer_dir != "":
+        local_map = MemmapMapData(height=height, width=width, world_dir=layer_dir)
+    else:
+        local_map = MapData(height=height, width=width)
+    if cache_dir != "":
+        local_map.set_layer_cache(LayerCache(cache_dir))
+    return local_map
+
+
+# build a world from every mod of a template without any menu
+def generate_world(world_name: str, height: int, width: int, template_dir: str = "Create_World_Template/Default",
+                   seed: int = None, layer_dir: str = "", chunk_size: int = 0, cache_dir: str = "",
+                   max_workers: int = 1) -> 'World':
+    local_map = new_map(height, width, layer_dir, chunk_size, cache_dir)
+    mods_load = Module.mods_set_up_headless(["Create_World_Module/"], template_dir, local_map, None,
+                                            max_workers=max_workers, seed=seed)
+    return World(world_name, local_map, mods_load)
+
+
 create_world_menu = {
     0: "Name The World To Be Created",
     1: "Set The World Dimensions",
-    2: "Continue To Mods"
+    2: "Store Layers On Disk",
+    3: "Generate Chunks On Demand",
+    4: "Set The World Seed",
+    5: "Layer Cache Directory",
+    6: "Continue To Mods"
 }
 
 
@@ -113,6 +513,18 @@ def output_function_map(choice: list, output: dict, window: UI.tcod_window) -> d
         output["height"] = window.pop_frame(thisin)
         thisin = UI.ntcod_input(OFH, OFW, OFHS, OFWS,   output["width"], "width[0-9]", True)
         output["width"] = window.pop_frame(thisin)
+    elif choice[-1][0] == 'Store Layers On Disk':
+        thisin = UI.ntcod_input(OFH, OFW, OFHS, OFWS,   output["layer_dir"], "layer directory, empty keeps them in memory", False)
+        output["layer_dir"] = window.pop_frame(thisin)
+    elif choice[-1][0] == 'Generate Chunks On Demand':
+        thisin = UI.ntcod_input(OFH, OFW, OFHS, OFWS,   output["chunk_size"], "chunk size[0-9], 0 generates everything up front", True)
+        output["chunk_size"] = window.pop_frame(thisin)
+    elif choice[-1][0] == 'Set The World Seed':
+        thisin = UI.ntcod_input(OFH, OFW, OFHS, OFWS,   output["seed"], "seed[0-9]", True)
+        output["seed"] = window.pop_frame(thisin)
+    elif choice[-1][0] == 'Layer Cache Directory':
+        thisin = UI.ntcod_input(OFH, OFW, OFHS, OFWS,   output["cache_dir"], "cache directory, empty regenerates every layer", False)
+        output["cache_dir"] = window.pop_frame(thisin)
     elif choice[-1][0] == 'Continue To Mods':
         output["continue"] = True
     return output
@@ -123,6 +535,10 @@ deoutput = {
     "world_name": "New World",
     "height": 100,
     "width": 100,
+    "layer_dir": "",
+    "chunk_size": 0,
+    "seed": 0,
+    "cache_dir": "",
     "continue": False
 }
 
@@ -133,6 +549,8 @@ def main() -> None:
     menu = UI.ntcod_menu(OTH, OTW, OTH, OTW,  title="Create World Menu")
     menu.set_direct_menu(create_world_menu)
     window = UI.tcod_window(background, menu)
+    output = copy.deepcopy(deoutput)
+    output["seed"] = random.randint(0, 99999999)
     while True:
         UI.CONSOLE.clear()
 
@@ -141,7 +559,7 @@ def main() -> None:
         if choice == "last_page":
             return
         UI.CONSOLE.clear()
-        output = output_function_map(choice, copy.deepcopy(deoutput), window)
+        output = output_function_map(choice, output, window)
         if output["continue"]:
             output["continue"] = False
             break
@@ -149,12 +567,12 @@ def main() -> None:
     world_name = output["world_name"]
     height = output["height"]
     width = output["width"]
-    local_map = MapData(height=height, width=width)
+    local_map = new_map(height, width, output["layer_dir"], output["chunk_size"], output["cache_dir"])
 
-    mods_load = Module.mods_set_up(["Create_World_Module/"], "Create_World_Template/", local_map, None)
+    mods_load = Module.mods_set_up(["Create_World_Module/"], "Create_World_Template/", local_map, None,
+                                   seed=output["seed"])
     if mods_load is None:
         return
-    # weather 0.2684 sec
 
     world = World(world_name, local_map, mods_load)
     thisin = UI.ntcod_input(OFH, OFW, OFHS, OFWS,  "world", "input name of world file", False)
@@ -29,6 +29,20 @@ def main_update(action_time, local_map: Main_Menu.Create_World_State.MapData, pe
     return [str(action_time), str(end_operation - start_operation)]
 
 
+# advance a world and a civilization without a console, plugins draw into a null window
+def simulate(world, civilization, turns: int, action_time=1) -> list:
+    local_map = world.get_map()
+    peoples = civilization.get_peoples()
+    mods = dict(world.get_mods())
+    mods.update(civilization.get_mods())
+
+    window = UI.null_window()
+    timings = []
+    for turn in range(turns):
+        timings.append(main_update(action_time, local_map, peoples, mods, window))
+    return timings
+
+
 def play(continue_game = False) -> None:
     mod_manager = PluginManager()
     mod_manager.setPluginPlaces(["Create_World_Module/", "Create_Civilization_Module/", "Create_Gameplay_Module/"])
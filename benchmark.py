@@ -0,0 +1,169 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import tcod
+from Main_Menu import Create_World_State
+from Create_World_Module.Noise_Layer.Noise_Layer import Noise_Plane
+from Library import Module
+from Library import UI
+
+
+SIZES = [100, 250, 500, 1000, 2000]
+
+
+def run_world(size: int, template_dir: str, seed: int, updates: int, memory: bool, chunk_size: int) -> dict:
+    # mods go one at a time so each time and peak belongs to a single mod
+    mod_manager = Module.collect_mods(["Create_World_Module/"])
+    plugins = {}
+    for pluginInfo in mod_manager.getAllPlugins():
+        plugins[pluginInfo.name] = pluginInfo.plugin_object
+    mod_ordered = []
+    config_ordered = []
+    module_ordered = []
+    Module.load_template(template_dir, mod_ordered, config_ordered, module_ordered)
+    graph = Module.build_mod_graph(mod_ordered, config_ordered)
+
+    local_map = Create_World_State.new_map(size, size, chunk_size=chunk_size)
+    mods = {}
+    results = {}
+    for mod_id, module in zip(mod_ordered, module_ordered):
+        if module not in plugins:
+            continue
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        mods[mod_id] = plugins[module].initialize(map=local_map, peoples=None, mods=mods, obj=graph[mod_id][0],
+                                                  seed=Module.mod_seed(seed, mod_id))
+        results[mod_id] = {"module": module, "init_seconds": time.perf_counter() - start, "update_seconds": []}
+        if memory:
+            results[mod_id]["init_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    # the same calls Play.main_update makes, timed mod by mod
+    window = UI.null_window()
+    for turn in range(updates):
+        for mod_id in mods:
+            # some mods build their content on the first update, its peak is kept as well
+            first = memory and (turn == 0)
+            if first:
+                tracemalloc.start()
+            start = time.perf_counter()
+            if mod_id == "timeline":
+                mods[mod_id].update(action_time=1)
+            else:
+                mods[mod_id].update(map=local_map, peoples=None, mods=mods, window=window)
+            results[mod_id]["update_seconds"].append(time.perf_counter() - start)
+            if first:
+                results[mod_id]["first_update_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+    return {"height": size, "width": size, "mods": results, "layer_bytes": local_map.get_memory_report()}
+
+
+# the Noise_Layer generator as it was before the octaves were summed in place, kept to compare against
+def baseline_noise(obj, seed, height, width):
+    rand = random.Random(seed)
+    layers = obj["layers"]
+    noise_gen = []
+    total_weight = 0
+    for this_layer in range(len(layers)):
+        noise_gen.append(tcod.noise.Noise(dimensions=2, seed=rand.randint(0, 2147483647)))
+        total_weight = total_weight + layers[str(this_layer)][0]
+
+    value = np.zeros((height, width))
+    for this_layer in range(len(layers)):
+        weight, scale = layers[str(this_layer)]
+        value = value + weight * (noise_gen[this_layer][tcod.noise.grid(shape=(width, height), scale=scale,
+                                                                        origin=(0, 0))] + 1.0) * 0.5
+    value = value / total_weight
+    value = np.power(value, obj["power"])
+    if obj["resize"]:
+        value = (value - value.min()) / (value.max() - value.min())
+        value = np.clip(value, 0, 1)
+    return value
+
+
+def current_noise(obj, seed, height, width):
+    return Noise_Plane(obj, seed).generate(0, 0, height, width)
+
+
+def run_noise(size: int, template_dir: str, seed: int, memory: bool) -> dict:
+    # the baseline and the current generator on the same raw elevation config and seed
+    with open(template_dir + "/Raw_Elevation.json", 'r') as file:
+        obj = json.loads(file.read())
+    file.close()
+    obj["implementation"] = "layers"
+
+    results = {}
+    values = {}
+    for name, generator in [("baseline", baseline_noise), ("current", current_noise)]:
+        start = time.perf_counter()
+        values[name] = generator(obj, seed, size, size)
+        seconds = time.perf_counter() - start
+        results[name] = {"seconds": seconds, "cells_per_second": size * size / seconds}
+        if memory:
+            # tracemalloc slows every allocation down, so the peak comes from a second, untimed call
+            tracemalloc.start()
+            generator(obj, seed, size, size)
+            results[name]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    results["speedup"] = results["baseline"]["seconds"] / results["current"]["seconds"]
+    # float32 against float64, the two only differ by rounding
+    results["max_difference"] = float(np.abs(values["baseline"] - values["current"]).max())
+    return {"height": size, "width": size, "implementations": results}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="time and measure world generation mod by mod")
+    parser.add_argument("--sizes", type=int, nargs="*", default=SIZES, help="side lengths of square maps")
+    parser.add_argument("--template", default="Create_World_Template/Default")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--updates", type=int, default=3, help="turns to time after generation")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass for peak memory")
+    parser.add_argument("--chunk-size", type=int, default=0)
+    parser.add_argument("--noise", type=int, nargs="*", default=[], help="also time the baseline and current Noise_Layer generator at these sizes")
+    parser.add_argument("--output", default="", help="json file, standard output when empty")
+    args = parser.parse_args(argv)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "template": args.template,
+        "seed": args.seed,
+        "chunk_size": args.chunk_size,
+        "runs": [],
+        "noise": []
+    }
+    for size in args.sizes:
+        print("world " + str(size) + "x" + str(size), file=sys.stderr)
+        run = run_world(size, args.template, args.seed, args.updates, False, args.chunk_size)
+        if not args.no_memory:
+            # tracemalloc slows every allocation down, so the peaks come from a second, untimed pass
+            peaks = run_world(size, args.template, args.seed, min(args.updates, 1), True, args.chunk_size)
+            for mod_id in run["mods"]:
+                for key in ["init_peak_bytes", "first_update_peak_bytes"]:
+                    if key in peaks["mods"][mod_id]:
+                        run["mods"][mod_id][key] = peaks["mods"][mod_id][key]
+        report["runs"].append(run)
+    for size in args.noise:
+        print("noise " + str(size) + "x" + str(size), file=sys.stderr)
+        report["noise"].append(run_noise(size, args.template, args.seed, not args.no_memory))
+
+    if args.output == "":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        file.close()
+
+
+if __name__ == "__main__":
+    main()
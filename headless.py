@@ -0,0 +1,72 @@
+import argparse
+from Main_Menu import Create_Civilization_State, Create_World_State, Play
+from Library import IO
+from Library import Module
+
+
+def world_command(args) -> None:
+    world = Create_World_State.generate_world(args.name, args.height, args.width, args.template, args.seed,
+                                              args.layer_dir, args.chunk_size, args.cache_dir, args.workers)
+    IO.save_object_to_file(args.save_path, args.file_name, "world", world, False)
+
+
+def civilization_command(args) -> None:
+    civilization = Create_Civilization_State.generate_civilization(args.name, args.population, args.template,
+                                                                   args.seed)
+    IO.save_object_to_file(args.save_path, args.file_name, "civilization", civilization, False)
+
+
+def simulate_command(args) -> None:
+    # saved mods refer to the plugin modules, load them before the files
+    Module.collect_mods(["Create_World_Module/", "Create_Civilization_Module/"])
+    world = IO.load_object_from_file(args.world)
+    civilization = IO.load_object_from_file(args.civilization)
+    for action_time, elapse_time in Play.simulate(world, civilization, args.turns, args.action_time):
+        print(action_time + " in-game time took " + elapse_time + " seconds")
+    IO.save_object_to_file(args.save_path, args.world_name, "world", world, False)
+    IO.save_object_to_file(args.save_path, args.civilization_name, "civilization", civilization, False)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="generate worlds and civilizations without a window")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    world = commands.add_parser("world", help="create a .world file from a world template")
+    world.add_argument("--name", default="New World")
+    world.add_argument("--template", default="Create_World_Template/Default")
+    world.add_argument("--height", type=int, default=100)
+    world.add_argument("--width", type=int, default=100)
+    world.add_argument("--seed", type=int, default=None)
+    world.add_argument("--layer-dir", default="", help="store layers on disk in this directory")
+    world.add_argument("--chunk-size", type=int, default=0, help="generate chunks of this size on demand")
+    world.add_argument("--cache-dir", default="", help="reuse generated layers from this directory")
+    world.add_argument("--workers", type=int, default=1, help="mods initialized side by side, 1 initializes them in order")
+    world.add_argument("--save-path", default="Play/")
+    world.add_argument("--file-name", default="world")
+    world.set_defaults(function=world_command)
+
+    civilization = commands.add_parser("civilization", help="create a .civilization file from a civilization template")
+    civilization.add_argument("--name", default="New Civilization")
+    civilization.add_argument("--template", default="Create_Civilization_Template/Default")
+    civilization.add_argument("--population", type=int, default=2000)
+    civilization.add_argument("--seed", type=int, default=None)
+    civilization.add_argument("--save-path", default="Play/")
+    civilization.add_argument("--file-name", default="civilization")
+    civilization.set_defaults(function=civilization_command)
+
+    simulate = commands.add_parser("simulate", help="run turns of a world and a civilization and save them back")
+    simulate.add_argument("--world", default="Play/world.world")
+    simulate.add_argument("--civilization", default="Play/civilization.civilization")
+    simulate.add_argument("--turns", type=int, default=1)
+    simulate.add_argument("--action-time", type=int, default=1)
+    simulate.add_argument("--save-path", default="Play/")
+    simulate.add_argument("--world-name", default="world")
+    simulate.add_argument("--civilization-name", default="civilization")
+    simulate.set_defaults(function=simulate_command)
+
+    args = parser.parse_args(argv)
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import json
+import os
+
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Main_Menu.Create_World_State import ChunkedMapData, MapData
+from Create_World_Module.Day_Night_Circle.Day_Night_Circle import Day_Night_Circle
+
+
+def test_light_layer_is_writable_and_reports_its_memory():
+    with open("Create_World_Template/Default/Day_Night_Circle.json") as file:
+        obj = json.load(file)
+    # a chunked map has not built any of the layer before it is read
+    for local_map, startup_bytes in [(MapData(20, 40), 20 * 40 * 4), (ChunkedMapData(20, 40, 16), 0)]:
+        day_night = Day_Night_Circle(local_map, obj)
+        assert local_map.get_memory_report()["sun_light"] == startup_bytes
+        light = local_map.get_writable_attribute("sun_light")
+        assert np.array_equal(light, np.tile(day_night.profile, (20, 1)))
+        local_map.set_attribute_at("sun_light", 3, 5, 0.5)
+        assert local_map.get_attribute_at("sun_light", 3, 5) == 0.5
+        assert local_map.get_memory_report()["sun_light"] == 20 * 40 * 4
@@ -0,0 +1,19 @@
+import os
+
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Create_World_Module.Dungeon_Map.Dungeon_Map import Dungeon_Stub
+
+
+FLOOR = [" ", [180, 180, 180], [60, 60, 60], "#", [180, 180, 180], [120, 120, 120]]
+
+
+def test_neighbouring_dungeons_do_not_share_levels():
+    stub = Dungeon_Stub(0, 0, 100, 40, 60, 4, 6, FLOOR, 8, levels=3)
+    neighbour = Dungeon_Stub(0, 0, 101, 40, 60, 4, 6, FLOOR, 8, levels=3)
+    second_level = Dungeon_Stub(0, 0, 100, 40, 60, 4, 6, FLOOR, 8, levels=3, depth=1)
+    assert second_level.level_seed() != neighbour.level_seed()
+    assert stub.level_seed() == Dungeon_Stub(0, 0, 100, 40, 60, 4, 6, FLOOR, 8, levels=3).level_seed()
+    assert not np.array_equal(second_level.generate().walkable, neighbour.generate().walkable)
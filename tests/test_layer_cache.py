@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Library.Cache import LayerCache, layer_key
+from Main_Menu.Create_World_State import ChunkedMapData, MapData
+from Create_World_Module.Noise_Layer.Noise_Layer import Noise_Layer
+
+NOISE = {"id": "raw_elevation", "Module": "Noise_Layer", "Require": [], "implementation": "layers",
+         "layers": {"0": [1, 0.1], "1": [0.5, 0.3]}, "power": 2, "resize": True}
+
+
+def noise_layer(cache_dir):
+    local_map = MapData(64, 64)
+    local_map.set_layer_cache(LayerCache(cache_dir))
+    return local_map, Noise_Layer(local_map, NOISE, 7)
+
+
+def test_cached_noise_layer_keeps_its_resize_range(tmp_path):
+    cold_map, cold = noise_layer(str(tmp_path))
+    warm_map, warm = noise_layer(str(tmp_path))
+
+    assert warm_map.get_layer_cache().hits == 2
+    assert np.array_equal(cold_map.get_attribute("raw_elevation"), warm_map.get_attribute("raw_elevation"))
+    assert np.array_equal(cold.sample(-16, 80, 32, 32), warm.sample(-16, 80, 32, 32))
+
+
+def test_layer_key_changes_with_the_generator_version():
+    assert layer_key("Noise_Layer", NOISE, [], 7, 64, 64, "a") != layer_key("Noise_Layer", NOISE, [], 7, 64, 64, "b")
+
+
+def test_chunked_noise_layer_matches_the_plain_map_with_a_declared_range():
+    declared = dict(NOISE, value_range=[0.1, 0.6])
+    plain_map = MapData(300, 200)
+    Noise_Layer(plain_map, declared, 7)
+    chunked_map = ChunkedMapData(300, 200, 32)
+    Noise_Layer(chunked_map, declared, 7)
+    assert np.array_equal(plain_map.get_attribute("raw_elevation"), chunked_map.get_attribute("raw_elevation"))
+
+
+def test_chunked_noise_layer_generates_nothing_at_startup():
+    layers = []
+    for chunk_size in [32, 100]:
+        chunked_map = ChunkedMapData(1000, 1000, chunk_size)
+        Noise_Layer(chunked_map, NOISE, 7)
+        assert chunked_map.get_memory_report()["raw_elevation"] == 0
+        layers.append(chunked_map.get_region("raw_elevation", 100, 100, 200, 200))
+    assert np.array_equal(layers[0], layers[1])
@@ -0,0 +1,52 @@
+import os
+import pickle
+
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Main_Menu.Create_World_State import MemmapMapData
+
+
+def memmap_map(world_dir):
+    local_map = MemmapMapData(16, 16, world_dir)
+    local_map.register_layer("weather", np.int32)
+    local_map.set_attribute("weather", np.zeros((16, 16), dtype=np.int32))
+    return local_map
+
+
+def test_layer_without_views_is_written_in_place(tmp_path):
+    local_map = memmap_map(str(tmp_path))
+    files = os.listdir(tmp_path)
+    for turn in range(5):
+        weather = local_map.get_writable_attribute("weather")
+        weather += 1
+        local_map.set_attribute("weather", weather)
+        local_map.set_attribute_at("weather", 0, 0, turn)
+
+    assert os.listdir(tmp_path) == files
+    assert local_map.get_attribute_at("weather", 0, 0) == 4
+    assert local_map.get_attribute_at("weather", 8, 8) == 5
+
+
+def test_views_keep_their_layer_and_superseded_files_are_removed(tmp_path):
+    local_map = memmap_map(str(tmp_path))
+    for turn in range(5):
+        rows = local_map.get_attribute("weather")[2:4]
+        local_map.set_attribute_at("weather", 2, 2, turn + 1)
+        assert rows[0, 2] == turn
+        local_map.set_attribute("weather", local_map.get_attribute("weather") + 0)
+        assert rows[0, 2] == turn
+
+    assert local_map.get_attribute_at("weather", 2, 2) == 5
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_saved_map_reopens_its_layers_from_another_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    local_map = memmap_map("world")
+    local_map.set_attribute_at("weather", 1, 1, 7)
+    saved = pickle.dumps(local_map)
+
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert pickle.loads(saved).get_attribute_at("weather", 1, 1) == 7
@@ -0,0 +1,40 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Main_Menu.Create_World_State import MapData
+from Create_Civilization_Module.Settlements.Settlements import Settlements
+
+
+class Peoples:
+    def __init__(self, number):
+        self.number = number
+        self.attributes = {}
+
+    def get_number(self):
+        return self.number
+
+    def set_attribute(self, attribute, value):
+        self.attributes[attribute] = [value] * self.number
+
+    def set_attribute_to(self, attribute, index, value):
+        self.attributes[attribute][index] = value
+
+
+def test_settlements_that_do_not_fit_are_left_out_with_a_warning():
+    with open("Create_Civilization_Template/Default/Settlements.json") as file:
+        obj = json.load(file)
+    settlements = Settlements(obj, Peoples(2000))
+    local_map = MapData(10, 10)
+    biomes = np.zeros((10, 10), dtype=np.uint8)
+    biomes[2, 3] = biomes[7, 8] = obj["prefered_biome"]
+    local_map.register_layer("biomes", np.uint8)
+    local_map.set_attribute("biomes", biomes)
+
+    with pytest.warns(UserWarning, match="not placed"):
+        positions = settlements.place_settlements(local_map)
+    assert sorted(positions.values()) == [[2, 3], [7, 8]]
@@ -0,0 +1,28 @@
+import os
+
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Library import Module
+from Main_Menu.Create_World_State import generate_world
+from Main_Menu.Create_Civilization_State import generate_civilization
+from Main_Menu import Play
+
+
+def test_entering_a_default_settlement_opens_a_town():
+    Module.collect_mods(["Create_World_Module/", "Create_Civilization_Module/"])
+    world = generate_world("test", 120, 120, seed=5, max_workers=1)
+    civilization = generate_civilization("test", 1000, seed=5)
+    Play.simulate(world, civilization, 2)
+
+    mods = dict(world.get_mods())
+    mods.update(civilization.get_mods())
+    local_map = world.get_map()
+    y, x = mods["settlements"].get_positions()[0]
+    stub = local_map.get_submap(y, x)[0][1]
+    town = local_map.open_submap(y, x, 0, mods=mods)
+
+    assert len(stub.families) > 0
+    assert (town.get_attribute("households") >= 0).sum() == len(stub.families)
+    assert local_map.open_submap(y, x, 0, mods=mods) is town
@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Library import UI
+from Main_Menu.Create_World_State import MapData
+from Create_Civilization_Module.Trails.Trails import Trails
+
+
+class Settlements:
+    def get_positions(self):
+        return {0: [10, 4], 1: [10, 20], 2: [10, 35]}
+
+
+def test_settlements_in_a_row_get_two_roads_around_the_sea():
+    local_map = MapData(20, 40)
+    biomes = np.full((20, 40), 2, dtype=np.uint8)
+    # a strait of sea with a land bridge at the top
+    biomes[3:, 12:14] = 14
+    local_map.register_layer("biomes", np.uint8)
+    local_map.set_attribute("biomes", biomes)
+
+    trails = Trails({"id": "trails", "icon_color": [199, 184, 163], "elevation_id": "elevation",
+                     "biome_id": "biomes", "settlements_id": "settlements"})
+    trails.update(map=local_map, mods={"settlements": Settlements()}, window=UI.null_window())
+
+    assert len(trails.valid_paths) == 2
+    ends = sorted(sorted([path[0], path[-1]]) for path in trails.valid_paths)
+    assert ends == [[(10, 4), (10, 20)], [(10, 20), (10, 35)]]
+    for path in trails.valid_paths:
+        assert all(biomes[y, x] != 14 for y, x in path)